@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
 # stdlib imports
+import copy
 import datetime
 import os
+import time
 # third-party imports
 import asana
+from concurrent import futures
 import dateparser
 import pytz
 import requests
@@ -14,6 +17,10 @@ from lib import RateLimitError
 from lib import RetrieveDataResult
 from lib import RetrieveMetadataResult
 from lib import ServiceUnavailableError
+from lib import merge_metadata_pages
+from lib.ratelimit import get_rate_limiter
+from lib.stream import CHUNK_SIZE, spool
+from lib.transport import get_transport
 
 
 def parse_date(s):
@@ -50,16 +57,68 @@ def parse_datetime(s):
     return dt
 
 
+def _shift(s, milliseconds):
+    """
+    Returns timestamp s moved by milliseconds, in ISO 8601.
+    """
+    return (parse_datetime(s) + datetime.timedelta(milliseconds=milliseconds)).isoformat()
+
+
+class PacedClient(asana.Client):
+    """
+    Asana client that waits for its rate limiter before every request.
+    """
+    rate_limiter = None
+
+    def request(self, method, path, **options):
+        if self.rate_limiter is not None: self.rate_limiter.acquire()
+        # asana.Client is an old-style class, super() does not apply
+        return asana.Client.request(self, method, path, **options)
+
+    pass
+
+
 class AsanaDriver(object):
 
-    def __init__(self, personal_access_token):
+    DATASOURCE = 'asana'
+
+    # Fields `_task_docs` reads, requested with the task listing itself
+    TASK_FIELDS = [
+        'name', 'notes', 'created_at', 'modified_at', 'completed',
+        'completed_at', 'due_at', 'due_on', 'hearted', 'projects.name',
+        'tags.name', 'assignee.name', 'parent.name',
+    ]
+
+    # Fields `_task_docs` reads from a task's attachment listing
+    ATTACHMENT_FIELDS = ['name', 'created_at', 'parent.name']
+
+    # Fields kept for each project of the cached topology
+    PROJECT_FIELDS = ['name', 'archived']
+
+    # Seconds the workspace/project topology cached in the milestone is trusted
+    TOPOLOGY_TTL = 24 * 60 * 60
+
+    # Allowance for clock skew between us and Asana when skipping attachments
+    # listed by an earlier pass
+    CLOCK_SKEW_SECONDS = 5 * 60
+
+    def __init__(self, personal_access_token, search=False, project_workers=4):
+        """
+        :param bool search: Enumerate tasks with the workspace task search
+            (Asana premium) instead of events and per-project listings.
+        :param int project_workers: Number of projects listed at the same
+            time during a full crawl.
+        """
         self.personal_access_token = personal_access_token
+        self.search = search
+        self.project_workers = max(1, project_workers)
+        self.rate_limiter = get_rate_limiter(AsanaDriver.DATASOURCE, personal_access_token)
         
         # initialize some fields
         self.client = None
-        self.me = None
         self.workspaces = None
         self.projects = None
+        self.budget = None
         return
     
     def __enter__(self):
@@ -70,24 +129,37 @@ class AsanaDriver(object):
         self.teardown()
         return
 
-    def _iter_tasks(self, modified_since=None):
+    def _spend(self, calls=1):
         """
-        Returns a list of all tasks.
+        Charges API calls against the budget of the running crawl.
         """
-        params = {}
-        if modified_since is not None: params['modified_since'] = modified_since.isoformat()
-        
-        for p in self.projects:
-            params['project'] = p['id']
-            
-            for t in self.client.tasks.find_all(params):
-                t['project'] = p
-                yield t
-                pass
-            pass
-        
+        if self.budget is not None: self.budget.spend(calls)
         return
 
+    def _retry_delay(self, e):
+        """
+        Seconds Asana asked us to wait after a RateLimitEnforcedError.
+        """
+        retry_after = getattr(e, 'retry_after', None)
+        if retry_after: return int(retry_after)
+        return self.rate_limiter.retry_delay()
+
+    def _get_task_page(self, project, offset=None, page_size=100):
+        """
+        Returns one page of a project's tasks, with every field in
+        `TASK_FIELDS`, and the offset of the next page (None on the last
+        page).
+        """
+        params = { 'project': project['id'] }
+
+        self._spend()
+        page = self.client.tasks.find_all(params, iterator_type=None, full_payload=True,
+                                          limit=page_size, offset=offset,
+                                          fields=AsanaDriver.TASK_FIELDS)
+        next_page = page.get('next_page')
+
+        return page['data'], next_page['offset'] if next_page else None
+
     def retrieve_data(self, doc):
         """
         Used to download content for a single doc. Typically this involves
@@ -109,18 +181,27 @@ class AsanaDriver(object):
                 
                 url = attachment['download_url']
                 
-                r = requests.get(url)
-                
-                return RetrieveDataResult(data=r.content)
+                r = get_transport().session.get(url, stream=True)
+                try:
+                    if r.status_code >= 500:
+                        raise ServiceUnavailableError( 'download answered {}'.format(r.status_code) )
+                    return RetrieveDataResult(data=spool(r.iter_content(CHUNK_SIZE)))
+                finally:
+                    r.close()
             else:
                 raise Exception( 'unexpected subtype: ' + repr(s) )
         except asana.error.NotFoundError, e:
-            raise ServiceUnavailableError( e.message )
+            # the attachment was deleted since it was crawled
+            return RetrieveDataResult(data=None, should_remove_doc=True)
         except asana.error.RateLimitEnforcedError, e:
-            raise RateLimitError( e.message )
+            raise RateLimitError( e.message, duration_seconds=self._retry_delay(e) )
+        except asana.error.ServerError, e:
+            raise ServiceUnavailableError( e.message )
+        except (requests.ConnectionError, requests.Timeout), e:
+            raise ServiceUnavailableError( e )
         return
 
-    def retrieve_metadata(self, milestone):
+    def retrieve_metadata(self, milestone, budget=None):
         """
         This function gathers the file manifest from the datasource. The only
         focus here is the metadata, such as name, container, mimetype, etc. No
@@ -131,110 +212,559 @@ class AsanaDriver(object):
             identifier that will allow the subsequent run to pick up indexing
             files where it last left off.
 
+        :param budget: Optional `Budget`. Once it is used up the crawl stops
+            at the next page boundary with retrieve_metadata_done=False.
+
         :returns `RetrieveMetadataResult` with the appropriate values populated.
         """
-        modified_since = milestone.get('lastrun')
-        modified_since = parse_datetime(modified_since)
+        return merge_metadata_pages(self.retrieve_metadata_pages(milestone, budget=budget), milestone)
+
+    def retrieve_metadata_pages(self, milestone, page_size=100, budget=None):
+        """
+        Same as `retrieve_metadata`, but yields a `RetrieveMetadataResult` per
+        page of events or tasks.
+
+        Projects are synced incrementally through the Events API, with one
+        sync token per project kept in milestone['sync'], and the time each
+        token was taken in milestone['synced']. Projects without a
+        token (new ones, or ones whose token expired) are then listed in
+        full; the crawl position is kept in milestone['crawl'] so a crawl
+        interrupted after any page, or stopped by the budget, resumes from
+        the next one.
+
+        In search mode, see `_search_pages`. Should the search leave gaps,
+        every project is listed in full once it is done.
+
+        Workspaces and projects come from the topology cached in the
+        milestone, see `_load_topology`.
+        """
+        sync = milestone.setdefault('sync', {})
+        milestone.setdefault('synced', {})
+
+        self.budget = budget
 
-        docs = []
-        
         try:
-            for t in self._iter_tasks(modified_since=modified_since):
-                task = self.client.tasks.find_by_id(task=t['id'])
-                task_created = parse_datetime( task['created_at'] )
-                task_modified = parse_datetime( task['modified_at'] )
-                
-                if modified_since is None or task_modified >= modified_since:
-                    # build document meta for task
-                    doc = {
-                        'external_id' : task['id'],
-                        'dirty': False,
-                        
-                        'title' : task['name'],
-                        'content' : task['notes'],
-                        'url': 'https://app.asana.com/0/{project_id}/{task_id}'.format(project_id=t['project']['id'], task_id=t['id']),
-                        'path': map(lambda p: p['name'], task['projects']),
-                        'created': task_created,
-                        'edited': task_modified,
-                        'tag': map(lambda tag: tag['name'], task['tags']),
-                        'as_assignee': [ task['assignee']['name'] , task['assignee']['id'] ] if task['assignee'] else None,
-                        'as_completed': task['completed'],
-                        'as_completed_date': parse_datetime( task['completed_at'] ),
-                        'as_due_date': parse_datetime( task['due_at'] or task['due_on'] or None ),
-                        'as_hearted': task['hearted'],
-                        'parent_name' : task['parent']['name'] if task['parent'] else None,
-                    }
-                    docs.append(doc)
-                    pass
-                
-                # get attachments for task
-                attachments = self.client.attachments.find_by_task(task=t['id'])
-                
-                # loop through attachments, and add to document pool
-                for a in attachments:
-                    attachment = self.client.attachments.find_by_id(attachment=a['id'])
-                    attachment_created = parse_datetime( attachment['created_at'] )
-                    
-                    if modified_since and attachment_created < modified_since:
+            self._load_topology(milestone)
+
+            if self.search:
+                # a gap crawl left unfinished resumes before the next search
+                gap_crawl = milestone.get('search_gaps') and 'crawl' in milestone
+                if not gap_crawl:
+                    for page in self._search_pages(milestone, page_size):
+                        yield page
+
+                    # stopped by the budget
+                    if 'search' in milestone:
+                        return
+
+                if milestone.get('search_gaps'):
+                    if 'crawl' not in milestone:
+                        milestone['sync'] = {}
+                        milestone['synced'] = {}
+                    for page in self._crawl_pages(milestone, page_size):
+                        yield page
+
+                    # stopped by the budget
+                    if 'crawl' in milestone:
+                        return
+                    del milestone['search_gaps']
+
+                yield RetrieveMetadataResult(
+                    milestone=copy.deepcopy(milestone),
+                    retrieve_metadata_done=True
+                )
+                return
+
+            for project in list(self.projects):
+                if str(project['id']) not in sync:
+                    continue
+
+                for page in self._event_pages(project, milestone):
+                    yield page
+
+                if budget is not None and budget.exhausted:
+                    return
+                pass
+
+            for page in self._crawl_pages(milestone, page_size):
+                yield page
+
+            # stopped by the budget
+            if 'crawl' in milestone:
+                return
+        except asana.error.NoAuthorizationError, e:
+            raise AuthRevokedError( e.message )
+        except asana.error.RateLimitEnforcedError, e:
+            raise RateLimitError( e.message, duration_seconds=self._retry_delay(e) )
+        except asana.error.ServerError, e:
+            raise ServiceUnavailableError( e.message )
+        except (requests.ConnectionError, requests.Timeout), e:
+            raise ServiceUnavailableError( e )
+
+        yield RetrieveMetadataResult(
+            milestone=copy.deepcopy(milestone),
+            retrieve_metadata_done=True
+        )
+        return
+
+    def _sync_token(self, project):
+        """
+        Returns a fresh events sync token for a project.
+        """
+        self._spend()
+        try:
+            self.client.events.get({ 'resource': project['id'] })
+        except asana.error.InvalidTokenError, e:
+            # Asana answers a request without a token with a new one
+            return e.sync
+
+        return None
+
+    def _event_pages(self, project, milestone):
+        """
+        Yields a `RetrieveMetadataResult` per page of a project's events
+        since its sync token, advancing the token as it goes.
+
+        An expired token is dropped from the milestone, so the project gets
+        listed in full by `_crawl_pages`. Events about the project itself
+        refresh its cached topology entry.
+        """
+        key = str(project['id'])
+
+        has_more = True
+        while has_more:
+            if self.budget is not None and self.budget.exhausted:
+                return
+
+            requested = datetime.datetime.utcnow().isoformat()
+            self._spend()
+            try:
+                result = self.client.events.get({ 'resource': project['id'], 'sync': milestone['sync'][key] },
+                                                full_payload=True)
+            except asana.error.InvalidTokenError:
+                del milestone['sync'][key]
+                milestone['synced'].pop(key, None)
+                return
+            except asana.error.NotFoundError:
+                self._forget_project(project, milestone)
+                return
+
+            if any(e['type'] == 'project' and (e.get('resource') or {}).get('id') == project['id']
+                   for e in result['data']):
+                if not self._refresh_project(project):
+                    self._forget_project(project, milestone)
+                    return
+
+            since = self._attachments_since(milestone['synced'].get(key))
+            docs, doc_ids_to_remove = self._event_docs(project, result['data'], since)
+            milestone['sync'][key] = result['sync']
+            milestone['synced'][key] = requested
+            has_more = result.get('has_more', False)
+
+            yield RetrieveMetadataResult(
+                milestone=copy.deepcopy(milestone),
+                docs=docs,
+                doc_ids_to_remove=doc_ids_to_remove
+            )
+            pass
+
+        return
+
+    def _load_topology(self, milestone):
+        """
+        Sets `workspaces` and `projects` from milestone['topology'], fetching
+        it again first if it is missing or older than `TOPOLOGY_TTL`.
+        """
+        topology = milestone.get('topology')
+        if not topology or topology['fetched'] + AsanaDriver.TOPOLOGY_TTL < time.time():
+            topology = milestone['topology'] = self._fetch_topology()
+
+        self.workspaces = topology['workspaces']
+        self.projects = topology['projects']
+        return
+
+    def _fetch_topology(self):
+        """
+        Lists the user's workspaces and their projects.
+        """
+        self._spend()
+        me = self.client.users.me(fields=['workspaces.name'])
+
+        workspaces = []
+        projects = []
+        for w in me['workspaces']:
+            workspaces.append({ 'id': w['id'], 'name': w['name'] })
+
+            self._spend()
+            for p in self.client.projects.find_all({ 'workspace': w['id'] }, fields=AsanaDriver.PROJECT_FIELDS):
+                projects.append({
+                    'id': p['id'],
+                    'name': p['name'],
+                    'archived': p['archived'],
+                    'workspace': { 'id': w['id'] },
+                })
+                pass
+            pass
+
+        return { 'fetched': int(time.time()), 'workspaces': workspaces, 'projects': projects }
+
+    def _refresh_project(self, project):
+        """
+        Updates a cached project from Asana.
+
+        :returns bool False if the project no longer exists
+        """
+        self._spend()
+        try:
+            p = self.client.projects.find_by_id(project['id'], fields=AsanaDriver.PROJECT_FIELDS)
+        except asana.error.NotFoundError:
+            return False
+
+        project['name'] = p['name']
+        project['archived'] = p['archived']
+        return True
+
+    def _forget_project(self, project, milestone):
+        """
+        Drops a deleted project from the cached topology and the sync tokens.
+        """
+        if project in self.projects: self.projects.remove(project)
+        milestone['sync'].pop(str(project['id']), None)
+        milestone['synced'].pop(str(project['id']), None)
+        return
+
+    def _attachments_since(self, timestamp):
+        """
+        Returns the time from which attachments are new to a pass that
+        follows one started at timestamp, or None if every attachment is.
+        """
+        if timestamp is None: return None
+        return parse_datetime(timestamp) - datetime.timedelta(seconds=AsanaDriver.CLOCK_SKEW_SECONDS)
+
+    def _event_docs(self, project, events, attachments_since=None):
+        """
+        Returns the docs of the tasks touched by events, and the ids of the
+        tasks and attachments they deleted. See `_task_docs` for
+        attachments_since.
+        """
+        task_ids = []
+        doc_ids_to_remove = []
+        for event in events:
+            resource = event.get('resource') or {}
+            parent = event.get('parent') or {}
+
+            if event['type'] == 'task':
+                if event['action'] == 'deleted':
+                    doc_ids_to_remove.append(resource['id'])
+                elif event['action'] in ('added', 'changed', 'undeleted'):
+                    task_ids.append(resource['id'])
+            elif event['type'] == 'attachment':
+                if event['action'] in ('deleted', 'removed'):
+                    doc_ids_to_remove.append(resource['id'])
+                elif parent.get('id'):
+                    # attachments are listed with their task
+                    task_ids.append(parent['id'])
+            pass
+
+        docs = []
+        for task_id in sorted(set(task_ids) - set(doc_ids_to_remove)):
+            self._spend()
+            try:
+                task = self.client.tasks.find_by_id(task_id, fields=AsanaDriver.TASK_FIELDS)
+            except asana.error.NotFoundError:
+                doc_ids_to_remove.append(task_id)
+                continue
+
+            task['project'] = project
+            docs.extend(self._task_docs(task, attachments_since))
+            pass
+
+        return docs, doc_ids_to_remove
+
+    def _search_task_page(self, workspace, params, page_size=100):
+        """
+        Returns one page of a workspace's tasks matching the search params,
+        in ascending order, with every field in `TASK_FIELDS`.
+        """
+        params = dict(params, sort_ascending=True, limit=page_size)
+
+        self._spend()
+        return self.client.get('/workspaces/{}/tasks/search'.format(workspace['id']), params,
+                               fields=AsanaDriver.TASK_FIELDS)
+
+    def _search_pages(self, milestone, page_size=100):
+        """
+        Yields a `RetrieveMetadataResult` per page of tasks modified since the
+        last complete pass, searched workspace by workspace.
+
+        Each task comes back once however many projects it belongs to, and
+        projects without changes cost nothing. The search has no offset, so
+        pages are walked by modified_at: milestone['search'] holds the
+        timestamp to resume after and the ids already seen at that
+        timestamp. Deletions are not reported by the search.
+
+        When a whole page shares one modified_at, the tasks modified at that
+        instant are walked by created_at instead, from search['tie']. If a
+        whole page of those also shares one created_at, that instant is
+        stepped over and recorded in milestone['search_gaps']; see
+        `retrieve_metadata_pages`.
+        """
+        search = milestone.get('search') or {
+            'started': datetime.datetime.utcnow().isoformat(),
+            'workspaces': [w['id'] for w in self.workspaces],
+            'after': milestone.get('lastrun'),
+            'seen': [],
+        }
+        milestone['search'] = search
+
+        workspaces = dict((w['id'], w) for w in self.workspaces)
+        since = self._attachments_since(milestone.get('lastrun'))
+
+        while search['workspaces']:
+            if self.budget is not None and self.budget.exhausted:
+                return
+
+            workspace = workspaces.get(search['workspaces'][0])
+            tie = search.get('tie')
+            if tie is None:
+                cursor, field = search, 'modified_at'
+                params = { 'sort_by': 'modified_at' }
+                if search['after'] is not None: params['modified_at.after'] = search['after']
+            else:
+                cursor, field = tie, 'created_at'
+                params = { 'sort_by': 'created_at',
+                           'modified_at.after': _shift(tie['at'], -1),
+                           'modified_at.before': _shift(tie['at'], 1) }
+                if tie['after'] is not None: params['created_at.after'] = tie['after']
+            tasks = self._search_task_page(workspace, params, page_size) if workspace else []
+
+            docs = []
+            for task in tasks:
+                if task['id'] in cursor['seen']:
+                    continue
+                docs.extend(self._task_docs(task, since))
+                pass
+
+            # advance cursor past this page
+            if len(tasks) < page_size:
+                if tie is None:
+                    search['workspaces'].pop(0)
+                    search['after'] = milestone.get('lastrun')
+                else:
+                    # every task modified at that instant was listed
+                    del search['tie']
+                    search['after'] = tie['at']
+                search['seen'] = []
+            else:
+                last = tasks[-1][field]
+                seen = [t['id'] for t in tasks if t[field] == last]
+                if len(seen) < len(tasks):
+                    # tasks sharing the last timestamp may spill onto the next page
+                    cursor['after'] = _shift(last, -1)
+                    cursor['seen'] = seen
+                elif tie is None:
+                    # a whole page modified at one instant, list it by creation
+                    search['tie'] = { 'at': last, 'after': None, 'seen': seen }
+                else:
+                    # a whole page created at one instant as well, leave it to a full crawl
+                    milestone.setdefault('search_gaps', []).append(tie['at'])
+                    tie['after'] = last
+                    tie['seen'] = []
+
+            yield RetrieveMetadataResult(
+                milestone=copy.deepcopy(milestone),
+                docs=docs
+            )
+            pass
+
+        # update milestone
+        milestone['lastrun'] = search['started']
+        del milestone['search']
+        return
+
+    def _crawl_page(self, project, offset=None, page_size=100):
+        """
+        Lists one page of a project's tasks and builds their docs.
+
+        :returns (sync token, docs, next offset). A sync token is only taken
+            before a project's first page; the next offset is None after its
+            last page.
+        """
+        token = self._sync_token(project) if offset is None else None
+        tasks, offset = self._get_task_page(project, offset=offset, page_size=page_size)
+
+        docs = []
+        for task in tasks:
+            task['project'] = project
+            docs.extend(self._task_docs(task))
+            pass
+
+        return token, docs, offset
+
+    def _crawl_pages(self, milestone, page_size=100):
+        """
+        Yields a `RetrieveMetadataResult` per page of the tasks of the
+        projects that have no sync token.
+
+        Up to `project_workers` projects are listed at the same time, and
+        pages are yielded as they complete. milestone['crawl'] maps every
+        project left to list to the offset of its next page, so whatever
+        page a crawl stops at, each project resumes where it was.
+
+        A project's token is taken before its first page is listed, so
+        changes made during the crawl are picked up by the next events pass.
+
+        When Asana rate limits a page, fewer projects are listed at a time
+        and the page is retried after the delay Asana asked for; once down
+        to a single project the error is raised.
+        """
+        crawl = milestone.get('crawl')
+        if not crawl or 'cursors' not in crawl:
+            crawl = {
+                'started': datetime.datetime.utcnow().isoformat(),
+                'cursors': dict((str(p['id']), None) for p in self.projects if str(p['id']) not in milestone['sync']),
+            }
+        milestone['crawl'] = crawl
+
+        projects = dict((str(p['id']), p) for p in self.projects)
+        pending = [str(p['id']) for p in self.projects if str(p['id']) in crawl['cursors']]
+
+        # forget projects that went away since the crawl started
+        for key in set(crawl['cursors']) - set(pending):
+            del crawl['cursors'][key]
+
+        workers = self.project_workers
+        running = {}
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            while pending or running:
+                exhausted = self.budget is not None and self.budget.exhausted
+                while pending and len(running) < workers and not exhausted:
+                    key = pending.pop(0)
+                    running[executor.submit(self._crawl_page, projects[key],
+                                            crawl['cursors'][key], page_size)] = key
+
+                if not running:
+                    return
+
+                done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    try:
+                        token, docs, offset = future.result()
+                    except asana.error.RateLimitEnforcedError, e:
+                        if workers == 1:
+                            raise
+                        workers = max(1, workers // 2)
+                        time.sleep(self._retry_delay(e))
+                        pending.insert(0, key)
                         continue
-                    
-                     # build document meta for attachment
-                    doc = {
-                        'external_id' : attachment['id'],
-                        'subtype' : 'attachment',
-                        'dirty': True,
-                        
-                        'title' : attachment['name'],
-                        'created': attachment_created,
-                        'path': [ attachment['parent']['name'] ],
-                        'container_url' : None,
-                        'parent_name' : attachment['parent']['name'],
-                    }
-                    docs.append(doc)
+
+                    # advance this project's cursor past the page
+                    if token:
+                        milestone['sync'][key] = token
+                        milestone['synced'][key] = crawl['started']
+                    if offset is None:
+                        del crawl['cursors'][key]
+                    else:
+                        crawl['cursors'][key] = offset
+                        pending.insert(0, key)
+
+                    yield RetrieveMetadataResult(
+                        milestone=copy.deepcopy(milestone),
+                        docs=docs
+                    )
                     pass
                 pass
-            
-            # update milestone
-            milestone['lastrun'] = datetime.datetime.utcnow()
+
+        # update milestone
+        milestone['lastrun'] = crawl['started']
+        del milestone['crawl']
+        return
+
+    def _task_docs(self, task, attachments_since=None):
+        """
+        Returns the docs for a task and its attachments.
+
+        task must carry the `TASK_FIELDS`; its attachments are listed with
+        one paginated call. The task's url points at task['project'] if set,
+        else at its first project; its path lists every project it is in.
+
+        Attachments never change once uploaded, so those created before
+        attachments_since, already listed by an earlier pass, are left out
+        rather than downloaded again.
+        """
+        docs = []
+
+        project = task.get('project') or (task['projects'][0] if task['projects'] else None)
+
+        task_created = parse_datetime( task['created_at'] )
+        task_modified = parse_datetime( task['modified_at'] )
+
+        # build document meta for task
+        doc = {
+            'external_id' : task['id'],
+            'dirty': False,
+
+            'title' : task['name'],
+            'content' : task['notes'],
+            'url': 'https://app.asana.com/0/{project_id}/{task_id}'.format(project_id=project['id'] if project else 0, task_id=task['id']),
+            'path': map(lambda p: p['name'], task['projects']),
+            'created': task_created,
+            'edited': task_modified,
+            'tag': map(lambda tag: tag['name'], task['tags']),
+            'as_assignee': [ task['assignee']['name'] , task['assignee']['id'] ] if task['assignee'] else None,
+            'as_completed': task['completed'],
+            'as_completed_date': parse_datetime( task['completed_at'] ),
+            'as_due_date': parse_datetime( task['due_at'] or task['due_on'] or None ),
+            'as_hearted': task['hearted'],
+            'parent_name' : task['parent']['name'] if task['parent'] else None,
+        }
+        docs.append(doc)
+
+        # get attachments for task
+        self._spend()
+        attachments = self.client.attachments.find_by_task(task=task['id'],
+                                                           fields=AsanaDriver.ATTACHMENT_FIELDS)
+
+        # loop through attachments, and add to document pool
+        for attachment in attachments:
+            attachment_created = parse_datetime( attachment['created_at'] )
+
+            if attachments_since and attachment_created < attachments_since:
+                continue
+
+             # build document meta for attachment
+            doc = {
+                'external_id' : attachment['id'],
+                'subtype' : 'attachment',
+                'dirty': True,
+
+                'title' : attachment['name'],
+                'created': attachment_created,
+                'path': [ attachment['parent']['name'] ],
+                'container_url' : None,
+                'parent_name' : attachment['parent']['name'],
+            }
+            docs.append(doc)
             pass
-        except asana.error.RateLimitEnforcedError, e:
-            raise RateLimitError( e.message )
-            
-        # build result object
-        result = RetrieveMetadataResult(
-            milestone=milestone,
-            retrieve_metadata_done=True,
-            docs=docs
-        )
-        
-        return result
+
+        return docs
 
     def setup(self):
         """
-        Creates connection to Asasna API, and pulls initial data.
+        Creates connection to Asasna API. Workspaces and projects are loaded
+        from the milestone by `retrieve_metadata_pages`.
         """
         
         if self.client is not None: return
         
-        # create api client
-        self.client = asana.Client.access_token(self.personal_access_token)
-        
-        # pull initial data
-        try:
-            self.me = self.client.users.me()
-            self.workspaces = self.me['workspaces']
-            self.projects = []
-            for w in self.workspaces:
-                for p in self.client.projects.find_all({ 'workspace': w['id'] }):
-                    #p['workspace'] = w
-                    self.projects.append(p)
-                    pass
-                pass
-        except asana.error.NoAuthorizationError, e:
-            raise AuthRevokedError( e.message )
-        except asana.error.RateLimitEnforcedError, e:
-            raise RateLimitError( e.message )
-       
+        # create api client, paced by the shared rate limiter
+        self.client = PacedClient.access_token(self.personal_access_token)
+        self.client.rate_limiter = self.rate_limiter
+        get_transport().mount(self.client.session)
+        self.client.session.hooks['response'].append(
+            lambda r, *args, **kwargs: self.rate_limiter.observe(r.status_code, r.headers))
+
         # configure client
         asana.Client.DEFAULTS['page_size'] = 1000
         return
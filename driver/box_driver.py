@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 
 # stdlib imports
-from collections import deque
+import copy
 import datetime
 import os
 # third-party imports
 import boxsdk
+from boxsdk.network.default_network import DefaultNetwork
 import dateparser
 import pytz
 import requests
@@ -15,6 +16,10 @@ from lib import RateLimitError
 from lib import RetrieveDataResult
 from lib import RetrieveMetadataResult
 from lib import ServiceUnavailableError
+from lib import merge_metadata_pages
+from lib.ratelimit import get_rate_limiter, retry_after_seconds
+from lib.stream import spooled_file
+from lib.transport import get_transport
 
 
 def parse_date(s):
@@ -51,13 +56,44 @@ def parse_datetime(s):
     return dt
 
 
+class PacedNetwork(DefaultNetwork):
+    """
+    Box network layer that waits for a rate limiter before every request and
+    reports every response back to it. Requests go through the shared
+    connection pools.
+    """
+
+    def __init__(self, rate_limiter):
+        super(PacedNetwork, self).__init__()
+        self.rate_limiter = rate_limiter
+        get_transport().mount(self._session)
+        return
+
+    def request(self, method, url, access_token, **kwargs):
+        self.rate_limiter.acquire()
+        response = super(PacedNetwork, self).request(method, url, access_token, **kwargs)
+        self.rate_limiter.observe(response.status_code, response.headers)
+        return response
+
+    pass
+
+
 class BoxDriver(object):
 
-    def __init__(self, client_id, client_secret, access_token, refresh_token):
+    DATASOURCE = 'box'
+
+    def __init__(self, client_id, client_secret, access_token, refresh_token, datasource_user_id=None):
+        """
+        :param datasource_user_id: Box account the credentials belong to. Its
+            requests are paced by a rate limiter kept under this id; Box hands
+            out a new refresh token on every refresh, so long-lived callers
+            must pass it. Defaults to the current refresh token.
+        """
         self.client_id = client_id
         self.client_secret = client_secret
         self.access_token = access_token
         self.refresh_token = refresh_token
+        self.rate_limiter = get_rate_limiter(BoxDriver.DATASOURCE, datasource_user_id or '{}:{}'.format(client_id, refresh_token))
 
         # initialize some fields
         self.client = None
@@ -72,17 +108,17 @@ class BoxDriver(object):
         self.teardown()
         return
 
-    def _iter_files(self, modified_since=None):
+    def _get_file_page(self, crawl, page_size=100):
         """
-        Returns a list of all files.
+        Returns the files in the next page of the folder crawl, and advances
+        the crawl past that page.
+
+        crawl['queue'] holds the folders left to list as [folder_id, parent_path]
+        pairs, crawl['offset'] the position within the first of them.
 
         See: https://github.com/box/box-python-sdk/blob/1.5/boxsdk/object/file.py
         """
 
-        queue = deque([
-            ('0', [])
-        ])
-
         fields = [
             'type',
             'id',
@@ -93,30 +129,38 @@ class BoxDriver(object):
             'modified_at',
             'tags',
             'parent',
+            'sha1',
         ]
 
-        while len(queue) > 0:
-            folder_id, parent_path = queue.popleft()
-
-            items_left = True
-            limit = 100
-            offset = 0
+        queue = crawl['queue']
+        folder_id, parent_path = queue[0]
 
-            while items_left:
-                items = self.client.folder(folder_id=folder_id).get_items(fields=fields, limit=limit, offset=offset)
-                items_left = len(items) >= limit
-                offset += len(items)
+        items = self.client.folder(folder_id=folder_id).get_items(fields=fields, limit=page_size, offset=crawl['offset'])
 
-                for item in items:
-                    if item['type'] == 'folder':
-                        queue.append(( item['id'] , parent_path+[item['id']] ))
-                    elif item['type'] == 'file':
-                        yield item
-                    pass
-                pass
+        files = []
+        for item in items:
+            if item['type'] == 'folder':
+                queue.append([ item['id'] , parent_path+[item['id']] ])
+            elif item['type'] == 'file':
+                files.append(item)
             pass
 
-        return
+        # move on to the next folder once this one is exhausted
+        if len(items) >= page_size:
+            crawl['offset'] += len(items)
+        else:
+            queue.pop(0)
+            crawl['offset'] = 0
+
+        return files
+
+    def _retry_delay(self, e):
+        """
+        Seconds Box asked us to wait after a 429.
+        """
+        retry_after = retry_after_seconds(getattr(e, 'headers', None))
+        if retry_after: return int(retry_after)
+        return self.rate_limiter.retry_delay()
 
     def retrieve_data(self, doc):
         """
@@ -136,20 +180,29 @@ class BoxDriver(object):
 
         try:
             if subtype == 'file':
-                item = self.client.file(file_id=external_id).get()
+                stream = spooled_file()
+                self.client.file(file_id=external_id).download_to(stream)
+                stream.seek(0)
 
-                return RetrieveDataResult(data=item.content())
+                return RetrieveDataResult(data=stream)
         except boxsdk.exception.BoxAPIException, e:
-            if e.code == 429:
-                raise RateLimitError( e.message )
+            if e.status == 404:
+                # the file was deleted since it was crawled
+                return RetrieveDataResult(data=None, should_remove_doc=True)
+            if e.status == 429:
+                raise RateLimitError( e.message, duration_seconds=self._retry_delay(e) )
+            if e.status >= 500:
+                raise ServiceUnavailableError( e.message )
             
             raise
         except boxsdk.exception.BoxOAuthException, e:
             raise AuthRevokedError( e.message )
+        except (requests.ConnectionError, requests.Timeout), e:
+            raise ServiceUnavailableError( e )
 
         return
 
-    def retrieve_metadata(self, milestone):
+    def retrieve_metadata(self, milestone, budget=None):
         """
         This function gathers the file manifest from the datasource. The only
         focus here is the metadata, such as name, container, mimetype, etc. No
@@ -160,56 +213,91 @@ class BoxDriver(object):
             identifier that will allow the subsequent run to pick up indexing
             files where it last left off.
 
+        :param budget: Optional `Budget`. Once it is used up the crawl stops
+            at the next page boundary with retrieve_metadata_done=False.
+
         :returns `RetrieveMetadataResult` with the appropriate values populated.
         """
 
+        return merge_metadata_pages(self.retrieve_metadata_pages(milestone, budget=budget), milestone)
+
+    def retrieve_metadata_pages(self, milestone, page_size=100, budget=None):
+        """
+        Same as `retrieve_metadata`, but yields a `RetrieveMetadataResult` per
+        page of folder items.
+
+        The pending folder queue is kept in milestone['crawl'], so a crawl
+        interrupted after any page, or stopped by the budget, resumes from
+        the next one.
+        """
+
+        crawl = milestone.get('crawl') or {
+            'started': datetime.datetime.utcnow().isoformat(),
+            'queue': [ ['0', []] ],
+            'offset': 0,
+        }
+        milestone['crawl'] = crawl
+
         modified_since = milestone.get('lastrun')
         modified_since = parse_datetime(modified_since)
 
-        docs = []
-
         try:
-            for item in self._iter_files(modified_since=modified_since):
-                item_created = parse_datetime( item['created_at'] )
-                
-                if modified_since and item_created < modified_since:
-                    continue
-
-                # build document meta for task
-                doc = {
-                    'external_id' : item['id'],
-                    'dirty': True,
-
-                    'title' : item['name'],
-                    'content' : item['description'],
-                    'url': item.get_url(),
-                    'path': map(lambda p: p['name'], item['path_collection']['entries']),
-                    'created': item['created_at'],
-                    'edited': item['modified_at'],
-                    'tag': item['tags'],
-                    'parent_name' : item['parent']['name'] if item['parent'] else None,
-                }
-                docs.append(doc)
+            while crawl['queue']:
+                if budget is not None and budget.exhausted:
+                    return
+
+                if budget is not None: budget.spend()
+                docs = []
+                for item in self._get_file_page(crawl, page_size=page_size):
+                    item_created = parse_datetime( item['created_at'] )
+
+                    if modified_since and item_created < modified_since:
+                        continue
+
+                    # build document meta for task
+                    doc = {
+                        'external_id' : item['id'],
+                        'dirty': True,
+
+                        'title' : item['name'],
+                        'content' : item['description'],
+                        'url': item.get_url(),
+                        'path': map(lambda p: p['name'], item['path_collection']['entries']),
+                        'created': item['created_at'],
+                        'edited': item['modified_at'],
+                        'tag': item['tags'],
+                        'parent_name' : item['parent']['name'] if item['parent'] else None,
+                        'content_version': item['sha1'],
+                    }
+                    docs.append(doc)
+                    pass
+
+                yield RetrieveMetadataResult(
+                    milestone=copy.deepcopy(milestone),
+                    docs=docs
+                )
                 pass
         except boxsdk.exception.BoxAPIException, e:
-            if e.code == 429:
-                raise RateLimitError( e.message )
-            
+            if e.status == 429:
+                raise RateLimitError( e.message, duration_seconds=self._retry_delay(e) )
+            if e.status >= 500:
+                raise ServiceUnavailableError( e.message )
+
             raise
         except boxsdk.exception.BoxOAuthException, e:
             raise AuthRevokedError( e.message )
+        except (requests.ConnectionError, requests.Timeout), e:
+            raise ServiceUnavailableError( e )
 
         # update milestone
-        milestone['lastrun'] = datetime.datetime.utcnow()
+        milestone['lastrun'] = crawl['started']
+        del milestone['crawl']
 
-        # build result object
-        result = RetrieveMetadataResult(
-            milestone=milestone,
-            retrieve_metadata_done=True,
-            docs=docs
+        yield RetrieveMetadataResult(
+            milestone=copy.deepcopy(milestone),
+            retrieve_metadata_done=True
         )
-
-        return result
+        return
 
     def setup(self):
         """
@@ -226,8 +314,8 @@ class BoxDriver(object):
             refresh_token=self.refresh_token
         )
 
-        # create api client
-        self.client = boxsdk.Client(self.oauth)
+        # create api client, paced by the shared rate limiter
+        self.client = boxsdk.Client(self.oauth, network_layer=PacedNetwork(self.rate_limiter))
 
         return
 
@@ -1,51 +1,168 @@
-import sys
+import copy
+import multiprocessing
 import time
 
-from tika import parser
-
 from lib.docstore import DocstoreLite
 from lib.db import get_milestone, upsert_milestone
-from lib import RetrieveMetadataResult, AuthRevokedError, RateLimitError, \
-                ServiceUnavailableError
+from lib.extraction.cache import content_digest, get_extraction_cache
+from lib.extraction.fastpath import fast_extract
+from lib.extraction.server import ExtractionError, TikaUnavailableError, get_tika_pool
+from lib.pipeline import Pipeline, Stage
+from lib.stream import as_stream, stream_size
+from lib import AuthRevokedError, Budget, RateLimitError, ServiceUnavailableError
+from lib.retry import RetryPolicy, get_circuit_breaker
 
 class ETLTaskLite(object):
-    def __init__(self, butter_user_id, datasource_user_id, driver):
+    # How long an account whose authorization was revoked is left alone
+    AUTH_REVOKED_SECONDS = 24 * 60 * 60
+
+    def __init__(self, butter_user_id, datasource_user_id, driver, workers=1,
+                 extract_workers=None, queue_size=16, extractor=None,
+                 metadata_seconds=None, metadata_calls=None, retry_policy=None,
+                 extraction_cache=None):
+        """
+        :param int workers: Number of `driver.retrieve_data` calls kept in
+            flight while handling dirty docs. The driver must be safe to call
+            from several threads when this is greater than 1.
+        :param int extract_workers: Number of docs extracted at the same
+            time. Defaults to the number of cores.
+        :param int queue_size: Maximum number of docs waiting between two
+            stages of the dirty doc pipeline.
+        :param extractor: `TikaPool` to run extraction on. Defaults to the
+            process-wide pool of a single Tika server, started on the first
+            doc that needs it and kept warm across tasks.
+        :param metadata_seconds: Wall time one `start` may spend retrieving
+            metadata. Drivers stop at a page boundary once it is spent, and
+            the next `start` resumes from the milestone.
+        :param metadata_calls: Datasource API calls one `start` may make while
+            retrieving metadata.
+        :param retry_policy: `RetryPolicy` for driver calls. Defaults to
+            exponential backoff behind the datasource's circuit breaker.
+        :param extraction_cache: `ExtractionCache` consulted before running
+            extraction. Defaults to the process-wide cache.
+        """
         self.butter_user_id = butter_user_id
         self.datasource_user_id = datasource_user_id
         self.docstore = DocstoreLite.get_instance()
         self.driver = driver
+        self.workers = max(1, workers)
+        self.extract_workers = extract_workers or multiprocessing.cpu_count()
+        self.queue_size = queue_size
+        self.extractor = extractor
+        self.metadata_seconds = metadata_seconds
+        self.metadata_calls = metadata_calls
+        self.retry_policy = retry_policy or RetryPolicy(
+            breaker=get_circuit_breaker(getattr(driver, 'DATASOURCE', type(driver).__name__)))
+        self.extraction_cache = extraction_cache or get_extraction_cache()
+        self.writes = self.docstore.write_buffer()
         self.milestone = get_milestone(butter_user_id, datasource_user_id) or {}
 
 
     def handle_dirty_docs(self):
-        dirty_docs = self.docstore.select(butter_user_id=self.butter_user_id,
-                                          datasource_user_id=self.datasource_user_id,
-                                          dirty=True)
+        """
+        Download, extract and store every dirty doc.
+
+        Each step runs as its own pipeline stage: downloads on `workers`
+        threads, extraction on `extract_workers` threads feeding the Tika
+        servers and docstore writes on a single thread. Writes go through
+        `self.writes` and are flushed in batches, and once more when the run
+        ends.
+
+        A doc that cannot be extracted is stored with its failure in
+        `extraction_failure` and is not retried until it changes again. If
+        the Tika server itself fails, the run stops with a
+        `TikaUnavailableError` and the docs left are kept dirty.
+        """
+        extractor = self.extractor or get_tika_pool()
+        self._run_dirty_doc_pipeline(extractor)
+
+    def _run_dirty_doc_pipeline(self, extractor):
+        dirty_docs = self.docstore.iter_select(butter_user_id=self.butter_user_id,
+                                               datasource_user_id=self.datasource_user_id,
+                                               dirty=True,
+                                               batch_size=self.queue_size)
 
-        for doc in dirty_docs:
-            result = self.driver.retrieve_data(doc)
+        def download(doc):
+            return doc, self.retry_policy.call(self.driver.retrieve_data, doc)
 
-            if result.data or result.unicode_data:
-                doc['content'] = parser.from_buffer(result.data)
+        def extract(item):
+            doc, result = item
+            if result.unicode_data is not None:
+                doc['content'] = result.unicode_data
+                return item
 
-            doc['dirty'] = False
-            self.docstore.update_raw([doc])
-            update_docs = [doc] + result.docs
+            stream = as_stream(result.data)
+            if stream is None:
+                return item
+
+            try:
+                doc['content'] = self.extract(extractor, doc, stream)
+            except ExtractionError as e:
+                doc['extraction_failure'] = unicode(e)
+            else:
+                if doc.get('extraction_failure'):
+                    doc['extraction_failure'] = None
+            finally:
+                stream.close()
+            return item
 
-            for d in [d for d in result.docs if 'butter_user_id' not in d]:
-                d['butter_user_id'] = doc['butter_user_id']
-                d['datasource_user_id'] = doc['datasource_user_id']
-            self.docstore.update_raw(update_docs)
+        def store(item):
+            self.store_retrieved_doc(*item)
 
-            if result.should_remove_doc:
-                self.docstore.delete(doc)
+        pipeline = Pipeline([Stage('download', download, self.workers),
+                             Stage('extract', extract, self.extract_workers),
+                             Stage('store', store)],
+                            queue_size=self.queue_size)
+        try:
+            for stats in pipeline.run(dirty_docs):
+                print(stats)
+            print(self.extraction_cache)
+        finally:
+            self.writes.flush()
 
-            if result.should_remove_children:
-                # handle any docs to be deleted
-                self.remove_child_docs(doc,
-                                       self.butter_user_id,
-                                       self.datasource_user_id,
-                                       [d['id'] for d in result.docs])
+    def extract(self, extractor, doc, stream):
+        """
+        Returns the extracted content of doc's downloaded stream.
+
+        Simple formats are extracted in-process. Anything else comes from the
+        extraction cache when the same bytes were extracted before, and from
+        Tika otherwise.
+        """
+        content = fast_extract(stream, doc.get('mime'),
+                               doc.get('file_name') or doc.get('title'))
+        if content is not None:
+            return content
+
+        digest = content_digest(stream)
+        content = self.extraction_cache.get(digest, stream_size(stream))
+        if content is None:
+            content = extractor.extract(stream)
+            self.extraction_cache.put(digest, content)
+
+        return content
+
+    def store_retrieved_doc(self, doc, result):
+        """
+        Apply an extracted `RetrieveDataResult` for doc to the docstore.
+        """
+        doc['dirty'] = False
+        self.writes.upsert([doc])
+        update_docs = [doc] + result.docs
+
+        for d in [d for d in result.docs if 'butter_user_id' not in d]:
+            d['butter_user_id'] = doc['butter_user_id']
+            d['datasource_user_id'] = doc['datasource_user_id']
+        self.writes.upsert(update_docs)
+
+        if result.should_remove_doc:
+            self.writes.delete(doc)
+
+        if result.should_remove_children:
+            # handle any docs to be deleted
+            self.remove_child_docs(doc,
+                                   self.butter_user_id,
+                                   self.datasource_user_id,
+                                   [d['id'] for d in result.docs])
 
     def remove_child_docs(self, doc, butter_user_id, datasource_user_id, ids_to_keep=None):
         """
@@ -54,80 +171,160 @@ class ETLTaskLite(object):
         Remove all docs that are children of the doc with parent_id, and
         whose id value is not in ids_to_keep
         """
-        to_delete = []
-        params = {
-            'butter_user_id': butter_user_id,
-            'datasource_user_id': datasource_user_id,
-            'type': doc['type'],
-            'parent_id': doc['id'],
-        }
-        for doc in self.docstore.select(**params):
-            if doc['id'] not in ids_to_keep:
-                title = doc.get('title', '_Untitled Evernote Resource_')
-                to_delete.append(doc)
-
-        if to_delete:
-            self.docstore.delete(to_delete)
+        self.docstore.delete_children(butter_user_id,
+                                      datasource_user_id,
+                                      doc['id'],
+                                      ids_to_keep,
+                                      type=doc['type'])
 
     def start(self):
-        if self.dirty_doc_count():
+        """
+        Run one pass for the user: handle dirty docs if there are any,
+        otherwise retrieve metadata unless the milestone postpones it.
+
+        Transient failures are retried according to `self.retry_policy`. If
+        they persist, or access was revoked, or the datasource rate limits
+        us, the account is postponed through milestone['next-sync'] and the
+        number of consecutive failed runs is kept in milestone['retries'].
+        A Tika server failure is not the datasource's doing: the dirty docs
+        are left for the next run.
+        """
+        try:
+            self._start()
+        except AuthRevokedError:
+            print('AuthRevokedError caught')
+            self.postpone(self.AUTH_REVOKED_SECONDS)
+        except RateLimitError as rate_limit:
+            self.postpone(rate_limit.duration_seconds)
+        except TikaUnavailableError as tika_error:
+            print('TikaUnavailableError caught: {}'.format(tika_error.error))
+        except ServiceUnavailableError as service_error:
+            print('ServiceUnavailableError caught')
+            self.milestone['retries'] = self.milestone.get('retries', 0) + 1
+            delay = 60 * (1 + self.retry_policy.delay(self.milestone['retries']))
+            self.postpone(max(delay, getattr(service_error, 'duration_seconds', 0)))
+        else:
+            if self.milestone.pop('retries', None):
+                upsert_milestone(self.butter_user_id,
+                                 self.datasource_user_id,
+                                 self.milestone)
+
+    def _start(self):
+        if self.docstore.exists(butter_user_id=self.butter_user_id,
+                                datasource_user_id=self.datasource_user_id,
+                                dirty=True):
             self.handle_dirty_docs()
-            sys.exit()
+            return
 
         if 'next-sync' in self.milestone and self.milestone['next-sync'] >= int(time.time()):
             delta = self.milestone['next-sync'] - int(time.time())
             print('waiting {} seconds before running again'.format(delta))
-            sys.exit(0)
+            return
 
+        done = False
+        while not done:
+            done = self.retry_policy.call(self.run_metadata_pass,
+                                          self.metadata_budget())
 
-        result = RetrieveMetadataResult(milestone=self.milestone,
-                                        retrieve_metadata_done=False)
-        while not result.retrieve_metadata_done:
-            try:
-                result = self.driver.retrieve_metadata(self.milestone)
-            except AuthRevokedError:
-                print('AuthRevokoedError caught')
-            except RateLimitError as rate_limit:
-                next_run = int(time.time()) + rate_limit.duration_seconds
-                self.milestone['next-sync'] = next_run
-                result = RetrieveMetadataResult(milestone=self.milestone, retrieve_metadata_done=True)
-            except ServiceUnavailableError as service_error:
-                print('ServiceUnavailableError caught')
+    def run_metadata_pass(self, budget=None):
+        """
+        Retrieve and commit metadata pages once, resuming from the milestone.
+
+        :returns bool True if no further pass is needed during this run
+        """
+        for page in self.retrieve_metadata_pages(budget):
+            self.commit_metadata_page(page)
+            if page.retrieve_metadata_done:
+                return True
+
+        if budget is not None and budget.exhausted:
+            print('metadata budget spent, resuming next run: {}'.format(budget))
+            return True
+
+        return False
+
+    def postpone(self, seconds):
+        """
+        Persist a milestone that keeps the account from syncing for seconds.
+        """
+        self.milestone['next-sync'] = int(time.time() + seconds)
+        upsert_milestone(self.butter_user_id,
+                         self.datasource_user_id,
+                         self.milestone)
+
+    def metadata_budget(self):
+        """
+        Returns a fresh `Budget` for one metadata pass, or None if unlimited.
+        """
+        if self.metadata_seconds is None and self.metadata_calls is None:
+            return None
 
+        return Budget(seconds=self.metadata_seconds, calls=self.metadata_calls)
+
+    def retrieve_metadata_pages(self, budget=None):
+        """
+        Yields the driver's metadata results page by page, starting from the
+        last committed milestone. Drivers without `retrieve_metadata_pages`
+        produce a single page and ignore the budget.
+        """
+        milestone = copy.deepcopy(self.milestone)
+        if hasattr(self.driver, 'retrieve_metadata_pages'):
+            for page in self.driver.retrieve_metadata_pages(milestone, budget=budget):
+                yield page
+        else:
+            yield self.driver.retrieve_metadata(milestone)
+
+    def commit_metadata_page(self, result):
+        """
+        Store a page of metadata, then persist the milestone it resumes from.
+        """
         self.process_docs(result)
         self.process_deletions(result.doc_ids_to_remove)
         upsert_milestone(self.butter_user_id,
                          self.datasource_user_id,
                          result.milestone)
+        self.milestone = result.milestone
 
     def dirty_doc_count(self):
-        dirty_docs = self.docstore.select(butter_user_id=self.butter_user_id,
-                                          datasource_user_id=self.datasource_user_id,
-                                          dirty=True)
-
-        return len(dirty_docs)
+        return self.docstore.count(butter_user_id=self.butter_user_id,
+                                   datasource_user_id=self.datasource_user_id,
+                                   dirty=True)
 
     def process_deletions(self, doc_ids_to_remove):
         """
         Delete docs with ids in doc_ids_to_remove
         :param list doc_ids_to_remove:
         """
-        for doc_id in doc_ids_to_remove:
-            params = {
-                'butter_user_id': self.butter_user_id,
-                'datasource_user_id': self.datasource_user_id,
-                'external_id': doc_id,
-            }
-            docs = self.docstore.select(**params)
-            self.docstore.delete(docs)
+        if not doc_ids_to_remove:
+            return
+
+        self.docstore.delete_by_external_ids(self.butter_user_id,
+                                             self.datasource_user_id,
+                                             doc_ids_to_remove)
 
     def process_docs(self, result):
         """
         Push metadata doc updates in result to Solr.
+
+        Docs carrying a `content_version` that matches the stored one only
+        had their metadata edited: they are not marked dirty again, and keep
+        their extracted content.
         """
         if not result.docs:
             return
 
+        versioned = [doc['external_id'] for doc in result.docs
+                     if doc.get('content_version')]
+        if versioned:
+            stored = self.docstore.content_versions(self.butter_user_id,
+                                                    self.datasource_user_id,
+                                                    versioned)
+            for doc in result.docs:
+                version = doc.get('content_version')
+                if version and stored.get(doc['external_id']) == version:
+                    doc.pop('dirty', None)
+                    doc.pop('content', None)
+
         self.docstore.update(self.butter_user_id,
                              self.datasource_user_id,
                              result.docs)
@@ -1,5 +1,6 @@
 import attr
 from .errors import *
+from .budget import Budget
 from attr.validators import instance_of, optional
 
 @attr.s(frozen=True)
@@ -30,6 +31,34 @@ class RetrieveMetadataResult(object):
     retrieve_metadata_done = attr.ib(default=False,
                                      validator=instance_of(bool))
 
+def merge_metadata_pages(pages, milestone):
+    """
+    Collapse a stream of `RetrieveMetadataResult` pages into one result.
+
+    Drivers may implement `retrieve_metadata_pages(milestone, page_size)`, a
+    generator yielding one `RetrieveMetadataResult` per page of the crawl.
+    Each page's milestone is a snapshot that resumes the crawl right after
+    that page, so callers can store a page's docs and then persist its
+    milestone before asking for the next one. Only the last page of a
+    complete crawl has retrieve_metadata_done set.
+
+    milestone is returned as-is if the stream yields no pages at all.
+    """
+    docs = []
+    doc_ids_to_remove = []
+    actions = []
+    page = RetrieveMetadataResult(milestone=milestone)
+    for page in pages:
+        docs.extend(page.docs)
+        doc_ids_to_remove.extend(page.doc_ids_to_remove)
+        actions.extend(page.actions)
+
+    return RetrieveMetadataResult(milestone=page.milestone,
+                                  docs=docs,
+                                  doc_ids_to_remove=doc_ids_to_remove,
+                                  actions=actions,
+                                  retrieve_metadata_done=page.retrieve_metadata_done)
+
 @attr.s(frozen=True)
 class RetrieveDataResult(object):
     """
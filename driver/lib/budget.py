@@ -0,0 +1,38 @@
+import threading
+import time
+
+
+class Budget(object):
+    """
+    Limits the work a single `retrieve_metadata` invocation may do.
+
+    Drivers call `spend` for every API request and stop at the next page
+    boundary once `exhausted` is true, returning a milestone that resumes
+    the crawl with retrieve_metadata_done set to False.
+    """
+    def __init__(self, seconds=None, calls=None):
+        """
+        :param seconds: Wall time allowed, or None for no limit.
+        :param calls: API requests allowed, or None for no limit.
+        """
+        self.seconds = seconds
+        self.calls = calls
+        self.started = time.time()
+        self.calls_made = 0
+        self._lock = threading.Lock()
+
+    def spend(self, calls=1):
+        with self._lock:
+            self.calls_made += calls
+
+    @property
+    def exhausted(self):
+        if self.seconds is not None and time.time() - self.started >= self.seconds:
+            return True
+        if self.calls is not None and self.calls_made >= self.calls:
+            return True
+        return False
+
+    def __repr__(self):
+        return 'Budget(seconds={}, calls={}, used {:.1f}s and {} calls)'.format(
+            self.seconds, self.calls, time.time() - self.started, self.calls_made)
@@ -1,5 +1,7 @@
-from .helper import initialize_tables, get_milestone, upsert_milestone
+from .helper import initialize_tables, get_milestone, upsert_milestone, \
+                    get_datasources, acquire_lease, release_lease, reset_conn
 
 initialize_tables()
 
-__all__ = ['upsert_milestone', 'get_milestone']
+__all__ = ['upsert_milestone', 'get_milestone', 'get_datasources',
+           'acquire_lease', 'release_lease', 'reset_conn']
@@ -1,15 +1,24 @@
 import sqlite3
 import json
+import threading
+import time
 
-CONN = None
+# sqlite connections can't be shared between threads, so each thread gets its own
+LOCAL = threading.local()
 
 def get_conn():
-    global CONN
-    if not CONN:
-        CONN = sqlite3.connect('.butter.db')
-        CONN.row_factory = dict_factory
+    conn = getattr(LOCAL, 'conn', None)
+    if not conn:
+        conn = LOCAL.conn = sqlite3.connect('.butter.db')
+        conn.row_factory = dict_factory
 
-    return CONN
+    return conn
+
+def reset_conn():
+    """
+    Forget this thread's connection, e.g. in a freshly forked process.
+    """
+    LOCAL.conn = None
 
 def get_cursor():
     return get_conn().cursor()
@@ -31,6 +40,17 @@ def initialize_tables():
         """
         cursor.execute(sql)
 
+    sql = """
+        CREATE TABLE IF NOT EXISTS lease (
+            butter_user_id int,
+            datasource_user_id text,
+            owner text,
+            expires int,
+            UNIQUE (butter_user_id, datasource_user_id)
+        )
+    """
+    cursor.execute(sql)
+
 def get_milestone(butter_user_id, datasource_user_id):
     cursor = get_cursor()
 
@@ -45,6 +65,22 @@ def get_milestone(butter_user_id, datasource_user_id):
 
     return None
 
+def get_datasources():
+    """
+    Returns every (butter_user_id, datasource_user_id) row with its milestone.
+    """
+    cursor = get_cursor()
+
+    sql = """
+        SELECT butter_user_id, datasource_user_id, milestone FROM datasource
+    """
+    cursor.execute(sql)
+    rows = cursor.fetchall()
+    for row in rows:
+        row['milestone'] = json.loads(row['milestone']) if row['milestone'] else {}
+
+    return rows
+
 def upsert_milestone(butter_user_id, datasource_user_id, milestone):
     cursor = get_cursor()
     if type(milestone) != dict:
@@ -59,6 +95,52 @@ def upsert_milestone(butter_user_id, datasource_user_id, milestone):
     cursor.execute(sql, (butter_user_id, datasource_user_id, json.dumps(milestone)))
     get_conn().commit()
 
+def acquire_lease(butter_user_id, datasource_user_id, owner, ttl):
+    """
+    Take or renew the lease on a user for `ttl` seconds.
+
+    Succeeds if nobody holds the lease, `owner` already holds it, or the
+    previous holder let it expire.
+
+    :returns bool whether owner now holds the lease
+    """
+    conn = get_conn()
+    cursor = conn.cursor()
+    now = int(time.time())
+
+    sql = """
+        INSERT OR IGNORE INTO lease
+            (butter_user_id, datasource_user_id, owner, expires)
+        VALUES
+            (?, ?, ?, ?)
+    """
+    cursor.execute(sql, (butter_user_id, datasource_user_id, owner, now + ttl))
+    acquired = cursor.rowcount == 1
+
+    if not acquired:
+        sql = """
+            UPDATE lease SET owner = ?, expires = ?
+            WHERE butter_user_id = ? AND datasource_user_id = ? AND
+                  (owner = ? OR expires < ?)
+        """
+        cursor.execute(sql, (owner, now + ttl, butter_user_id,
+                             datasource_user_id, owner, now))
+        acquired = cursor.rowcount == 1
+
+    conn.commit()
+    return acquired
+
+def release_lease(butter_user_id, datasource_user_id, owner):
+    """
+    Give up a lease held by owner.
+    """
+    sql = """
+        DELETE FROM lease WHERE butter_user_id = ? AND datasource_user_id = ? AND
+                                owner = ?
+    """
+    get_cursor().execute(sql, (butter_user_id, datasource_user_id, owner))
+    get_conn().commit()
+
 
 def dict_factory(cursor, row):
     d = {}
@@ -1,12 +1,19 @@
+import atexit
 import logging
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import datetime
+import threading
+import weakref
 
 from builtins import object
 
 from dateutil.parser import parse as parsedate
 
 DOCSTORE_INSTANCE = None
+INDEXES_ENSURED = False
+
+# Write buffers that may still hold pending writes, flushed at exit
+WRITE_BUFFERS = weakref.WeakSet()
 
 def memoize(function):
     memo = {}
@@ -21,7 +28,7 @@ def memoize(function):
 
 try:
     import pymongo
-    from pymongo import ReplaceOne, UpdateOne
+    from pymongo import ASCENDING, DeleteOne, IndexModel, ReplaceOne, UpdateOne
     from pymongo.errors import InvalidOperation
     has_pymongo = True
 except ImportError:
@@ -69,6 +76,42 @@ class DocstoreLite(object):
         db = self._mongo.get_default_database()
         self._mongo_collection = db[kwargs['mongo_collection']]
 
+    def ensure_indexes(self):
+        """
+        Creates the indexes backing the docstore's lookups.
+
+        See `mongo_index_specs` for how they are derived. Creating an index
+        that already exists is a no-op, and `get_instance` only calls this
+        once per process.
+
+        :return list(str): Names of the indexes.
+        """
+        models = [IndexModel(keys, background=True)
+                  for keys in mongo_index_specs()]
+        return self._mongo_collection.create_indexes(models)
+
+    def index_report(self):
+        """
+        Reports which index mongo picks for each indexed lookup.
+
+        :return dict: Maps the filter fields of a query to the name of the
+          index its winning plan uses, or None for a collection scan.
+        """
+        sample_values = {'int': 0, 'boolean': True}
+        schema = docstore_schema()
+        report = {}
+        for keys in mongo_index_specs():
+            query = {}
+            for mongo_field, _ in keys:
+                name = field_mapper('mongo_field', 'name')[mongo_field]
+                query[mongo_field] = sample_values.get(
+                    schema['fields'][name]['type'], '')
+            plan = self._mongo_collection.find(query).explain()
+            report[tuple(sorted(query))] = \
+                _plan_index_name(plan['queryPlanner']['winningPlan'])
+
+        return report
+
     def delete(self, docs):
         """
         Removes docs from mongo.
@@ -87,6 +130,100 @@ class DocstoreLite(object):
 
         return deleted
 
+    def delete_by_external_ids(self, butter_user_id, datasource_user_id,
+                               external_ids, chunk_size=1000):
+        """
+        Removes a user's docs by datasource id.
+
+        Docs are removed with one `$in` delete per `chunk_size` ids rather
+        than one query per id.
+
+        :param butter_user_id int: The Butter user owning the docs
+        :param datasource_user_id str: The datasource user owning the docs
+        :param external_ids list: Datasource ids of the docs to remove
+
+        :return list(int): The number of deleted docs for each chunk.
+        """
+        external_ids = list(external_ids)
+        counts = []
+        for start in range(0, len(external_ids), chunk_size):
+            result = self._mongo_collection.delete_many({
+                'butter_user_id': butter_user_id,
+                'datasource_user_id': datasource_user_id,
+                'external_id': {'$in': external_ids[start:start + chunk_size]},
+            })
+            counts.append(result.deleted_count)
+
+        return counts
+
+    def content_versions(self, butter_user_id, datasource_user_id,
+                         external_ids, chunk_size=1000):
+        """
+        Looks up the stored content version of a user's docs.
+
+        :param butter_user_id int: The Butter user owning the docs
+        :param datasource_user_id str: The datasource user owning the docs
+        :param external_ids list: Datasource ids of the docs to look up
+        :param chunk_size int: Number of ids per `$in` query
+
+        :return dict: content_version by external_id, for the docs that are
+          stored and have one.
+        """
+        mapper = field_mapper('name', 'mongo_field')
+        external_ids = list(external_ids)
+        versions = {}
+        for start in range(0, len(external_ids), chunk_size):
+            cursor = self._mongo_collection.find({
+                'butter_user_id': butter_user_id,
+                'datasource_user_id': datasource_user_id,
+                'external_id': {'$in': external_ids[start:start + chunk_size]},
+            }, {mapper['external_id']: True, mapper['content_version']: True})
+            for mongo_doc in cursor:
+                if mongo_doc.get(mapper['content_version']):
+                    versions[mongo_doc[mapper['external_id']]] = \
+                        mongo_doc[mapper['content_version']]
+
+        return versions
+
+    def delete_children(self, butter_user_id, datasource_user_id, parent_id,
+                        ids_to_keep, max_nin=10000, chunk_size=1000, **kwargs):
+        """
+        Removes the children of a doc, except those in ids_to_keep.
+
+        The reconciliation runs in mongo as a single `$nin` delete. Keep sets
+        larger than `max_nin` would make for an oversized query, so instead
+        the children's ids are scanned and compared against a set, and the
+        leftovers are removed with chunked `$in` deletes.
+
+        :param butter_user_id int: The Butter user owning the docs
+        :param datasource_user_id str: The datasource user owning the docs
+        :param parent_id str: The id of the parent doc
+        :param ids_to_keep list: Ids of children to leave in place
+        :param kwargs dict: Extra filters, see `select`.
+
+        :return int: The number of deleted docs.
+        """
+        kwargs.update(butter_user_id=butter_user_id,
+                      datasource_user_id=datasource_user_id,
+                      parent_id=parent_id)
+        filters = _mongo_filters(kwargs)
+        ids_to_keep = set(ids_to_keep or [])
+
+        if len(ids_to_keep) <= max_nin:
+            filters['_id'] = {'$nin': list(ids_to_keep)}
+            return self._mongo_collection.delete_many(filters).deleted_count
+
+        cursor = self._mongo_collection.find(filters, {'_id': True})
+        to_delete = [mongo_doc['_id'] for mongo_doc in cursor
+                     if mongo_doc['_id'] not in ids_to_keep]
+
+        deleted = 0
+        for start in range(0, len(to_delete), chunk_size):
+            result = self._mongo_collection.delete_many(
+                {'_id': {'$in': to_delete[start:start + chunk_size]}})
+            deleted += result.deleted_count
+
+        return deleted
 
     def update(self, butter_user_id, datasource_user_id, docs):
         """
@@ -129,6 +266,15 @@ class DocstoreLite(object):
             # The update request to mongo resulted in no changes, bail out.
             return
 
+    def write_buffer(self, max_ops=500, max_delay_ms=1000):
+        """
+        Returns a `DocstoreWriteBuffer` that batches writes to this docstore.
+
+        :param max_ops int: Number of pending docs that triggers a flush.
+        :param max_delay_ms int: Longest time a write may sit in the buffer.
+        """
+        return DocstoreWriteBuffer(self, max_ops, max_delay_ms)
+
     def select(self, limit=0, **kwargs):
         """
         Queries mongo based on ad hoc filters.
@@ -137,24 +283,57 @@ class DocstoreLite(object):
 
         :returns list of docs
         """
+        return list(self.iter_select(limit=limit, **kwargs))
+
+    def iter_select(self, fields=None, batch_size=1000, limit=0, **kwargs):
+        """
+        Queries mongo based on ad hoc filters, yielding docs one at a time.
 
-        allowed_filters = ('butter_user_id', 'datasource_user_id',
-                           'type', 'dirty', 'external_id', 'en_tag_guid',
-                           'en_notebook_guid', 'parent_id',
-                           'tr_board_id', 'tr_list_id', 'id', 'butter_team_id')
-        unallowed_options = [k for k in kwargs.keys() if k not in allowed_filters]
+        Unlike `select`, results are pulled from mongo `batch_size` docs at a
+        time and converted as they are consumed, so memory use does not grow
+        with the size of the result.
 
-        if unallowed_options:
-            raise ValueError('Unallowed filters `%s`', unallowed_options)
+        :param fields list: DocStore field names to return. The 'id' field is
+          always included. None returns every field.
+        :param batch_size int: Number of docs fetched per round trip.
+        :param kwargs dict: Filters for the query, see `select`.
 
-        if 'id' in kwargs:
-            kwargs['_id'] = kwargs['id']
-            del kwargs['id']
+        :returns generator of docs
+        """
+        projection = None
+        if fields is not None:
+            mapper = field_mapper('name', 'mongo_field')
+            projection = {mapper.get(field, field): True for field in fields}
 
-        cursor = mongo_docs = self._mongo_collection.find(kwargs)
+        cursor = self._mongo_collection.find(_mongo_filters(kwargs), projection)
+        cursor.batch_size(batch_size)
         if limit:
             cursor.limit(limit)
-        return self._convert_mongo_docs_to_docstore(cursor)
+
+        mapper = field_mapper('mongo_field', 'name')
+        return (_convert_mongo_doc_to_docstore(mapper, mongo_doc)
+                for mongo_doc in cursor)
+
+    def count(self, **kwargs):
+        """
+        Counts docs matching ad hoc filters without fetching them.
+
+        :param kwargs dict: Filters for the query, see `select`.
+
+        :returns int
+        """
+        return self._mongo_collection.count(_mongo_filters(kwargs))
+
+    def exists(self, **kwargs):
+        """
+        Checks whether any doc matches ad hoc filters.
+
+        :param kwargs dict: Filters for the query, see `select`.
+
+        :returns bool
+        """
+        return self._mongo_collection.find_one(_mongo_filters(kwargs),
+                                               {'_id': True}) is not None
 
     def get(self, butter_user_id, datasource_user_id, doc_id):
         """
@@ -234,23 +413,12 @@ class DocstoreLite(object):
         }
 
 
-    def _convert_mongo_docs_to_docstore(self, mongo_docs):
-        mapper = field_mapper('mongo_field', 'name')
-        docs = []
-        for mongo_doc in mongo_docs:
-            doc = {}
-            for key in mongo_doc.keys():
-                doc[mapper[key]] = mongo_doc[key]
-            docs.append(doc)
-
-        return docs
-
     @staticmethod
     def get_instance(host='localhost',
                      port=27017,
                      database='docstore',
                      collection='docs'):
-        global DOCSTORE_INSTANCE
+        global DOCSTORE_INSTANCE, INDEXES_ENSURED
         if not DOCSTORE_INSTANCE:
             DOCSTORE_INSTANCE = DocstoreLite()
             params = {
@@ -261,8 +429,219 @@ class DocstoreLite(object):
             }
             DOCSTORE_INSTANCE.connect(**params)
 
+        if not INDEXES_ENSURED:
+            DOCSTORE_INSTANCE.ensure_indexes()
+            INDEXES_ENSURED = True
+
         return DOCSTORE_INSTANCE
 
+# Fields `select` and friends may filter on
+SELECT_FILTERS = ('butter_user_id', 'datasource_user_id',
+                  'type', 'dirty', 'external_id', 'en_tag_guid',
+                  'en_notebook_guid', 'parent_id',
+                  'tr_board_id', 'tr_list_id', 'id', 'butter_team_id')
+
+
+# Fields every lookup is scoped by, most selective first
+INDEX_SCOPE = ('datasource_user_id', 'butter_user_id')
+
+
+def mongo_index_specs():
+    """
+    Returns the key lists of the docstore's MongoDB indexes.
+
+    There is one index on the scope fields, plus one per schema field marked
+    `mongo_indexed` with the scope fields in front of it. Every indexed field
+    must also be a `select` filter. MongoDB cannot put two array fields in one
+    compound index, so only the first multi valued field of each index is
+    kept.
+
+    :rtype list:
+    """
+    schema = docstore_schema()
+    indexed = [name for name, field in sorted(schema['fields'].iteritems())
+               if field['mongo_indexed']]
+
+    for name in indexed:
+        assert name in SELECT_FILTERS, \
+            'Field "{}" is mongo_indexed but not a select filter'.format(name)
+
+    specs = []
+    for name in [None] + indexed:
+        fields = list(INDEX_SCOPE) + ([name] if name else [])
+        has_array = False
+        keys = []
+        for field in fields:
+            if schema['fields'][field]['multi_valued']:
+                if has_array:
+                    continue
+                has_array = True
+            keys.append((schema['fields'][field]['mongo_field'], ASCENDING))
+        specs.append(keys)
+
+    return specs
+
+
+def _plan_index_name(plan):
+    """
+    Returns the index used by a mongo query plan, if any.
+    """
+    if 'indexName' in plan:
+        return plan['indexName']
+    for child in [plan.get('inputStage')] + plan.get('inputStages', []):
+        if child:
+            name = _plan_index_name(child)
+            if name:
+                return name
+    return None
+
+
+def _mongo_filters(kwargs):
+    """
+    Validates select filters and returns them as a mongo query.
+    """
+    unallowed_options = [k for k in kwargs.keys() if k not in SELECT_FILTERS]
+
+    if unallowed_options:
+        raise ValueError('Unallowed filters `%s`', unallowed_options)
+
+    filters = dict(kwargs)
+    if 'id' in filters:
+        filters['_id'] = filters.pop('id')
+
+    return filters
+
+
+def _convert_mongo_doc_to_docstore(mapper, mongo_doc):
+    return {mapper[key]: value for key, value in mongo_doc.iteritems()}
+
+
+class DocstoreWriteBuffer(object):
+    """
+    Write-behind buffer for DocstoreLite upserts and deletes.
+
+    Pending writes are merged by doc id, so a doc upserted several times
+    before a flush costs a single operation, and an upsert followed by a
+    delete only issues the delete. Buffered writes are sent as one unordered
+    bulk_write once `max_ops` docs are pending or the oldest write is
+    `max_delay_ms` old. Anything still pending is flushed at interpreter
+    exit, so a crash loses at most one batch.
+    """
+    def __init__(self, docstore, max_ops=500, max_delay_ms=1000):
+        self._docstore = docstore
+        self._logger = logging.getLogger(__name__)
+        self.max_ops = max_ops
+        self.max_delay = max_delay_ms / 1000.0
+
+        # doc id -> [deleted, doc to upsert or None]
+        self._pending = OrderedDict()
+        self._lock = threading.RLock()
+        self._timer = None
+        WRITE_BUFFERS.add(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.flush()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def upsert(self, docs):
+        """
+        Queue docs to be applied as-is, like `DocstoreLite.update_raw`.
+        """
+        schema = docstore_schema()
+        with self._lock:
+            for doc in docs:
+                entry = self._pending.get(doc['id'])
+                if entry is None:
+                    self._pending[doc['id']] = [False, dict(doc)]
+                elif entry[1] is None:
+                    entry[1] = dict(doc)
+                else:
+                    _merge_docs(schema, entry[1], doc)
+            self._after_write()
+
+    def delete(self, docs):
+        """
+        Queue docs to be removed, like `DocstoreLite.delete`.
+        """
+        if type(docs) is not list:
+            docs = [docs]
+
+        with self._lock:
+            for doc in docs:
+                self._pending[doc['id']] = [True, None]
+            self._after_write()
+
+    def flush(self):
+        """
+        Send all pending writes to mongo.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            if not self._pending:
+                return
+
+            pending, self._pending = self._pending, OrderedDict()
+            deletes = [DeleteOne({'_id': doc_id})
+                       for doc_id, (deleted, _) in pending.iteritems() if deleted]
+            upserts = _mongo_update_requests_for_docs(
+                [doc for _, doc in pending.itervalues() if doc is not None])
+
+            if any(deleted and doc is not None for deleted, doc in pending.itervalues()):
+                # A doc was deleted then written again; the delete has to land
+                # first, which an unordered batch does not guarantee.
+                batches = [deletes, upserts]
+            else:
+                batches = [deletes + upserts]
+
+            collection = self._docstore._mongo_collection
+            for batch in batches:
+                if batch:
+                    collection.bulk_write(batch, ordered=False)
+
+            self._logger.debug('Flushed %d deletes and %d upserts',
+                               len(deletes), len(upserts))
+
+    def _after_write(self):
+        if len(self._pending) >= self.max_ops:
+            self.flush()
+        elif self._pending and self._timer is None:
+            self._timer = threading.Timer(self.max_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+
+@atexit.register
+def _flush_write_buffers():
+    for write_buffer in list(WRITE_BUFFERS):
+        write_buffer.flush()
+
+
+def _merge_docs(schema, pending_doc, doc):
+    """
+    Fold doc into pending_doc, keeping values of append-only multi valued
+    fields from both.
+    """
+    for field, value in doc.iteritems():
+        schema_field = schema['fields'].get(field, {})
+        if field in pending_doc and value is not None and \
+                pending_doc[field] is not None and \
+                schema_field.get('multi_valued_operation') == 'append':
+            existing = pending_doc[field]
+            existing = existing if isinstance(existing, list) else [existing]
+            value = value if isinstance(value, list) else [value]
+            pending_doc[field] = existing + value
+        else:
+            pending_doc[field] = value
+
+
 def _mongo_update_requests_for_docs(docs):
     """
     Creates a list of pymongo BulkWriteOperation representing an insert or
@@ -114,6 +114,10 @@ _DDL = {
             # Name of underlying field in the backend persistent storage.
             # If this property is not set, "name" will be used as the field name instead.
             u"mongo_field": {u"type": str},
+            # Whether docs are looked up by this field in the backend persistent storage.
+            # Such fields get a MongoDB compound index together with the user fields,
+            # see DocstoreLite.ensure_indexes
+            u"mongo_indexed": {u"type": bool, u"default": False},
         }
     },
     # List of fields which will be copied from a source field
@@ -186,6 +190,7 @@ def _validate_schema_fields(unvalidated_fields):
         # Add a mongo field name for every validated field if one has not been
         # explicitly set already
         validated_field.setdefault(u'mongo_field', fname)
+        validated_field.setdefault(u'mongo_indexed', fields_schema[u'mongo_indexed'][u'default'])
 
         validated_fields[fname] = validated_field
 
@@ -0,0 +1,5 @@
+from .fastpath import fast_extract
+from .server import ExtractionError, TikaPool, TikaUnavailableError, get_tika_pool
+
+__all__ = ['ExtractionError', 'TikaPool', 'TikaUnavailableError', 'fast_extract',
+           'get_tika_pool']
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from ..stream import iter_chunks
+
+DEFAULT_PATH = '.butter-extraction.db'
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Puts after which the size of the cache is counted again, catching up with
+# results stored by other processes
+RECOUNT_PUTS = 1000
+
+# Fraction of max_bytes an eviction brings the cache down to
+EVICT_TO = 0.9
+
+_CACHES = {}
+_LOCK = threading.Lock()
+
+
+def content_digest(stream):
+    """
+    Returns the SHA-256 hex digest of a downloaded stream.
+    """
+    digest = hashlib.sha256()
+    for chunk in iter_chunks(stream):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCache(object):
+    """
+    On-disk cache of extraction results keyed by the digest of the bytes
+    they were extracted from.
+
+    Results are kept in an SQLite file. Once the stored results grow past
+    `max_bytes`, the least recently used ones are evicted until they are
+    back under `EVICT_TO` of it. The cache can be shared by threads and by
+    processes using the same file.
+
+    The size of the results is counted once when the cache is opened, then
+    kept as a running total; it is only counted again when the total says
+    the cache is full, and every `RECOUNT_PUTS` puts.
+    """
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._puts = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS extraction (
+                digest text PRIMARY KEY,
+                result text,
+                size int,
+                used real
+            )
+        """)
+        self._conn().execute("""
+            CREATE INDEX IF NOT EXISTS extraction_used ON extraction (used)
+        """)
+        self._conn().commit()
+        self._total = self._count(self._conn())
+
+    def _conn(self):
+        # sqlite connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if not conn:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+        return conn
+
+    def get(self, digest, data_size=0):
+        """
+        Returns the cached result for digest, or None.
+
+        :param int data_size: Size of the bytes the digest was taken from,
+            counted as saved on a hit.
+        """
+        conn = self._conn()
+        row = conn.execute('SELECT result FROM extraction WHERE digest = ?',
+                           (digest,)).fetchone()
+        if row is not None:
+            conn.execute('UPDATE extraction SET used = ? WHERE digest = ?',
+                         (time.time(), digest))
+            conn.commit()
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.bytes_saved += data_size
+
+        return json.loads(row[0])
+
+    def put(self, digest, result):
+        """
+        Store the result extracted from the bytes with digest, evicting least
+        recently used results if the cache is full.
+        """
+        value = json.dumps(result)
+        conn = self._conn()
+        conn.execute("""
+            INSERT OR REPLACE INTO extraction (digest, result, size, used)
+            VALUES (?, ?, ?, ?)
+        """, (digest, value, len(value), time.time()))
+
+        with self._lock:
+            # a replaced result is counted twice until the next count
+            self._total += len(value)
+            self._puts += 1
+            recount = self._total > self.max_bytes or self._puts % RECOUNT_PUTS == 0
+        if recount:
+            self._evict(conn)
+        conn.commit()
+
+    def _count(self, conn):
+        return conn.execute('SELECT COALESCE(SUM(size), 0) FROM extraction').fetchone()[0]
+
+    def _evict(self, conn):
+        """
+        Count the stored results, and evict least recently used ones if they
+        exceed max_bytes.
+        """
+        total = self._count(conn)
+        if total > self.max_bytes:
+            target = self.max_bytes * EVICT_TO
+            rows = conn.execute('SELECT digest, size FROM extraction ORDER BY used')
+            evicted = []
+            for digest, size in rows:
+                if total <= target:
+                    break
+                evicted.append((digest,))
+                total -= size
+            conn.executemany('DELETE FROM extraction WHERE digest = ?', evicted)
+
+        with self._lock:
+            self._total = total
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def __str__(self):
+        return 'extraction cache: {} hits, {} misses ({:.0%}), {} bytes saved'.format(
+            self.hits, self.misses, self.hit_rate, self.bytes_saved)
+
+
+def get_extraction_cache(path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Returns the process-wide `ExtractionCache` stored at path.
+    """
+    with _LOCK:
+        if path not in _CACHES:
+            _CACHES[path] = ExtractionCache(path, max_bytes)
+        return _CACHES[path]
+
+__all__ = ['ExtractionCache', 'content_digest', 'get_extraction_cache']
@@ -0,0 +1,193 @@
+import codecs
+import csv
+import HTMLParser
+import json
+import os
+
+from ..stream import stream_size
+
+# Largest payload worth extracting in-process; bigger ones go to Tika
+MAX_FAST_BYTES = 10 * 1024 * 1024
+
+FORMATS_BY_MIME = {
+    'text/plain': 'text',
+    'text/markdown': 'text',
+    'text/x-markdown': 'text',
+    'text/csv': 'csv',
+    'application/csv': 'csv',
+    'application/json': 'json',
+    'text/json': 'json',
+    'text/html': 'html',
+    'application/xhtml+xml': 'html',
+}
+
+MIMES_BY_FORMAT = {
+    'text': 'text/plain',
+    'csv': 'text/csv',
+    'json': 'application/json',
+    'html': 'text/html',
+}
+
+FORMATS_BY_EXTENSION = {
+    '.txt': 'text',
+    '.text': 'text',
+    '.log': 'text',
+    '.md': 'text',
+    '.markdown': 'text',
+    '.csv': 'csv',
+    '.json': 'json',
+    '.htm': 'html',
+    '.html': 'html',
+    '.xhtml': 'html',
+}
+
+
+def fast_format(mime=None, name=None):
+    """
+    Returns the simple format of a document, or None if it needs Tika.
+
+    :param str mime: Mime type of the document, if known
+    :param str name: File name of the document, if known
+    """
+    if mime:
+        fmt = FORMATS_BY_MIME.get(mime.split(';')[0].strip().lower())
+        if fmt:
+            return fmt
+
+    if name:
+        return FORMATS_BY_EXTENSION.get(os.path.splitext(name)[1].lower())
+
+    return None
+
+
+def fast_extract(stream, mime=None, name=None):
+    """
+    Extract text, Markdown, CSV, JSON and HTML documents without Tika.
+
+    :param stream: Seekable file-like object holding the document
+    :returns dict with 'status', 'metadata' and 'content', like
+        `tika.parser.from_buffer`, or None if the document needs Tika. Text
+        in an encoding other than UTF-8, without a byte order mark saying
+        so, is left to Tika's charset detection.
+    """
+    fmt = fast_format(mime, name)
+    if fmt is None or stream_size(stream) > MAX_FAST_BYTES:
+        return None
+
+    text = _decode(stream.read())
+    if text is None:
+        stream.seek(0)
+        return None
+    metadata = {'Content-Type': mime or MIMES_BY_FORMAT[fmt], 'X-Parsed-By': 'fastpath.' + fmt}
+
+    try:
+        if fmt == 'csv':
+            text = u'\n'.join(u' '.join(cell.decode('utf-8') for cell in row)
+                              for row in csv.reader(text.encode('utf-8').splitlines()))
+        elif fmt == 'json':
+            text = u'\n'.join(_json_strings(json.loads(text)))
+        elif fmt == 'html':
+            parser = _TextParser()
+            parser.feed(text)
+            parser.close()
+            text = parser.text()
+            if parser.title:
+                metadata['title'] = parser.title
+    except (ValueError, csv.Error, HTMLParser.HTMLParseError):
+        # malformed: index the raw text rather than fail
+        pass
+
+    return {'status': 200, 'metadata': metadata, 'content': text}
+
+
+# Byte order marks, UTF-32 first as its little endian mark starts with UTF-16's
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+]
+
+
+def _decode(data):
+    """
+    Returns data decoded from the encoding its byte order mark names, else
+    from UTF-8, or None if that fails or the text holds NUL characters.
+    """
+    encoding = 'utf-8'
+    for bom, bom_encoding in BOMS:
+        if data.startswith(bom):
+            data, encoding = data[len(bom):], bom_encoding
+            break
+
+    try:
+        text = data.decode(encoding)
+    except UnicodeDecodeError:
+        return None
+
+    return None if u'\x00' in text else text
+
+
+def _json_strings(value):
+    """
+    Yields the keys and string values of a JSON document.
+    """
+    if isinstance(value, dict):
+        for key, item in value.iteritems():
+            yield key
+            for s in _json_strings(item):
+                yield s
+    elif isinstance(value, list):
+        for item in value:
+            for s in _json_strings(item):
+                yield s
+    elif isinstance(value, basestring):
+        yield value
+
+
+class _TextParser(HTMLParser.HTMLParser):
+    """
+    Collects the visible text and title of an HTML document.
+    """
+    SKIPPED = ('script', 'style', 'head')
+    BLOCKS = ('p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+    def __init__(self):
+        HTMLParser.HTMLParser.__init__(self)
+        self.parts = []
+        self.title = None
+        self._skipping = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED:
+            self._skipping += 1
+        if tag == 'title':
+            self._in_title = True
+        if tag in self.BLOCKS:
+            self.parts.append(u'\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED and self._skipping:
+            self._skipping -= 1
+        if tag == 'title':
+            self._in_title = False
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title = (self.title or u'') + data
+        elif not self._skipping:
+            self.parts.append(data)
+
+    def handle_entityref(self, name):
+        self.handle_data(self.unescape(u'&{};'.format(name)))
+
+    def handle_charref(self, name):
+        self.handle_data(self.unescape(u'&#{};'.format(name)))
+
+    def text(self):
+        lines = (u' '.join(line.split()) for line in u''.join(self.parts).splitlines())
+        return u'\n'.join(line for line in lines if line)
+
+__all__ = ['fast_extract', 'fast_format']
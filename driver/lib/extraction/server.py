@@ -0,0 +1,247 @@
+import atexit
+import os
+import Queue
+import socket
+import subprocess
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..errors import ServiceUnavailableError
+from ..stream import iter_chunks, stream_size
+
+_POOLS = {}
+_LOCK = threading.Lock()
+_JAR_LOCK = threading.Lock()
+
+
+class ExtractionError(RuntimeError):
+    """
+    Raised when a document could not be extracted, e.g. it is too large or
+    Tika timed out or failed on it.
+    """
+    def __init__(self, error=None):
+        super(ExtractionError, self).__init__('Extraction error', error)
+        self.error = error
+
+
+class TikaUnavailableError(ServiceUnavailableError):
+    """
+    Raised when a Tika server could not be started or stopped answering.
+    The document it was given is not at fault and should be retried later.
+    """
+
+
+def server_jar():
+    """
+    Returns the path of the Tika server jar, downloading it the way
+    tika-python does on first use: from `TIKA_SERVER_JAR` to
+    `tika-server.jar` in the temporary directory.
+
+    :raises TikaUnavailableError: if the jar could not be downloaded
+    """
+    # tika.tika sets up logging and reads its settings on import
+    from tika import tika
+
+    jar = os.path.join(tika.TikaJarPath, 'tika-server.jar')
+    with _JAR_LOCK:
+        if os.path.isfile(jar):
+            return jar
+        try:
+            return tika.getRemoteJar(tika.TikaServerJar, jar)[0]
+        except (IOError, OSError), e:
+            raise TikaUnavailableError(e)
+
+
+class TikaServer(object):
+    """
+    One local Tika server JVM, reached over a keep-alive HTTP session.
+    """
+    def __init__(self, jar=None, java='java', startup_timeout=120):
+        """
+        :param str jar: Path of the Tika server jar. Defaults to the jar
+            tika-python uses, downloaded if needed.
+        """
+        self.jar = jar
+        self.java = java
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.port = None
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.port)
+
+    def start(self):
+        """
+        Start the JVM and block until it answers its health check.
+
+        :raises TikaUnavailableError: if the JVM could not be started
+        """
+        self.port = _free_port()
+        try:
+            self.process = subprocess.Popen([self.java, '-jar', self.jar or server_jar(),
+                                             '--host', '127.0.0.1',
+                                             '--port', str(self.port)],
+                                            stdout=open(os.devnull, 'w'),
+                                            stderr=subprocess.STDOUT)
+        except OSError, e:
+            raise TikaUnavailableError(e)
+
+        deadline = time.time() + self.startup_timeout
+        while not self.healthy():
+            if self.process.poll() is not None:
+                returncode = self.process.returncode
+                self.process = None
+                raise TikaUnavailableError('Tika server exited with {}'.format(returncode))
+            if time.time() > deadline:
+                self.stop()
+                raise TikaUnavailableError('Tika server did not start in {}s'.format(self.startup_timeout))
+            time.sleep(0.5)
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def healthy(self):
+        if not self.running:
+            return False
+        try:
+            return self.session.get(self.url + '/tika', timeout=5).ok
+        except requests.RequestException:
+            return False
+
+    def stop(self):
+        if self.running:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def extract(self, stream, timeout):
+        """
+        Parse a seekable stream with `/rmeta/text`. The stream is sent in
+        chunks, never read into memory as a whole.
+
+        :returns dict with 'status', 'metadata' and 'content', like
+            `tika.parser.from_buffer`
+        """
+        response = self.session.put(self.url + '/rmeta/text',
+                                    data=iter_chunks(stream),
+                                    headers={'Accept': 'application/json'},
+                                    timeout=timeout)
+        if not response.ok:
+            raise ExtractionError('Tika answered {}'.format(response.status_code))
+
+        metadata = response.json()[0]
+        return {
+            'status': response.status_code,
+            'content': metadata.pop('X-TIKA:content', None),
+            'metadata': metadata,
+        }
+
+
+class TikaPool(object):
+    """
+    A pool of Tika servers, each parsing one document at a time.
+
+    Long-running callers start and health check every server up front with
+    `start`; otherwise a server is started the first time it is handed a
+    document. Servers are kept warm afterwards. A server that times out is considered wedged and
+    stopped, and the document it was working on fails with an
+    `ExtractionError`. A server that cannot be started or drops the
+    connection is stopped as well, but the document is not at fault: a
+    `TikaUnavailableError` is raised instead. Stopped servers are started
+    again, and health checked, when next handed a document.
+    """
+    def __init__(self, instances=1, timeout=120, max_bytes=100 * 1024 * 1024,
+                 jar=None):
+        """
+        :param int instances: Maximum number of Tika server JVMs.
+        :param int timeout: Seconds a server may stay silent on a document.
+        :param int max_bytes: Larger documents are refused without parsing.
+        :param str jar: Path of the Tika server jar, see `TikaServer`.
+        """
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.servers = [TikaServer(jar) for _ in range(max(1, instances))]
+        self._idle = Queue.Queue()
+        for server in self.servers:
+            self._idle.put(server)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def start(self):
+        """
+        Start every server that is not running yet, and block until each one
+        answers its health check.
+
+        :raises TikaUnavailableError: if a server could not be started
+        """
+        for server in self.servers:
+            if not server.running:
+                server.start()
+
+    def extract(self, stream):
+        """
+        Parse a seekable stream on the next idle server.
+
+        :raises ExtractionError: if the stream is too large or could not be
+            parsed
+        :raises TikaUnavailableError: if no Tika server could parse it
+        """
+        size = stream_size(stream)
+        if size > self.max_bytes:
+            raise ExtractionError('{} bytes exceeds the {} bytes limit'.format(
+                size, self.max_bytes))
+
+        server = self._idle.get()
+        try:
+            if not server.running:
+                server.start()
+            return server.extract(stream, self.timeout)
+        except requests.ConnectionError, e:
+            server.stop()
+            raise TikaUnavailableError(e)
+        except requests.Timeout, e:
+            server.stop()
+            raise ExtractionError(e)
+        except ValueError, e:
+            raise ExtractionError(e)
+        finally:
+            self._idle.put(server)
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
+
+
+def get_tika_pool(instances=1):
+    """
+    Returns the process-wide `TikaPool`. Its servers are started on first
+    use and stopped when the process exits.
+    """
+    with _LOCK:
+        if 'pool' not in _POOLS:
+            _POOLS['pool'] = TikaPool(instances)
+            atexit.register(_POOLS['pool'].stop)
+        return _POOLS['pool']
+
+
+def _free_port():
+    sock = socket.socket()
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+__all__ = ['ExtractionError', 'TikaPool', 'TikaServer', 'TikaUnavailableError',
+           'get_tika_pool', 'server_jar']
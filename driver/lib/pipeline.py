@@ -0,0 +1,170 @@
+import sys
+import threading
+import time
+from Queue import Queue
+
+# Marks the end of a stage's input. One is queued per downstream worker.
+_DONE = object()
+
+
+class StageStats(object):
+    """
+    Counters for a single pipeline stage.
+
+    `busy_seconds` is the time the stage's workers spent inside the stage
+    function, so `utilization` close to 1.0 marks the stage the pipeline is
+    bound on.
+    """
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.items += 1
+            self.busy_seconds += seconds
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def throughput(self):
+        """Items per second over the lifetime of the stage."""
+        return self.items / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def utilization(self):
+        """Fraction of the stage's worker time spent doing work."""
+        capacity = self.elapsed * self.workers
+        return self.busy_seconds / capacity if capacity else 0.0
+
+    def __str__(self):
+        return '{}: {} items in {:.1f}s ({:.2f}/s, {:.0%} busy, {} workers)' \
+            .format(self.name, self.items, self.elapsed, self.throughput,
+                    self.utilization, self.workers)
+
+
+class Stage(object):
+    """
+    A step in a `Pipeline`.
+
+    :param str name: Label used in the stage's stats.
+    :param func: Called with each input item; its return value is handed to
+        the next stage.
+    :param int workers: Number of threads running func.
+    """
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+
+
+class Pipeline(object):
+    """
+    Runs items through a chain of stages, each on its own worker threads.
+
+    Stages are connected by queues holding at most `queue_size` items, so a
+    slow stage blocks the ones feeding it instead of letting work pile up in
+    memory.
+    """
+    def __init__(self, stages, queue_size=16):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stats = [StageStats(s.name, s.workers) for s in stages]
+        self._error = None
+        self._error_lock = threading.Lock()
+        self._aborted = threading.Event()
+
+    def run(self, items):
+        """
+        Push every item through the pipeline and wait for it to drain.
+
+        The first exception raised by a stage stops the feed and is re-raised
+        here once the workers have shut down.
+
+        :returns list of `StageStats`, one per stage
+        """
+        queues = [Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = []
+
+        for index, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for _ in range(stage.workers):
+                thread = threading.Thread(target=self._work,
+                                          args=(index, queues, remaining, lock))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+        try:
+            for item in items:
+                if self._aborted.is_set():
+                    break
+                queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_DONE)
+
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+
+        return self.stats
+
+    def _work(self, index, queues, remaining, lock):
+        stage = self.stages[index]
+        stats = self.stats[index]
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(queues) else None
+
+        with lock:
+            if stats.started is None:
+                stats.started = time.time()
+
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                break
+            if self._aborted.is_set():
+                # keep draining so upstream stages never block on a full queue
+                continue
+
+            start = time.time()
+            try:
+                result = stage.func(item)
+            except Exception:
+                self._abort()
+                continue
+            stats.record(time.time() - start)
+
+            if outbox is not None:
+                outbox.put(result)
+
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+            if last:
+                stats.finished = time.time()
+
+        if last and outbox is not None:
+            for _ in range(self.stages[index + 1].workers):
+                outbox.put(_DONE)
+
+    def _abort(self):
+        with self._error_lock:
+            if self._error is None:
+                self._error = sys.exc_info()
+        self._aborted.set()
+
+__all__ = ['Pipeline', 'Stage', 'StageStats']
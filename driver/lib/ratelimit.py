@@ -0,0 +1,173 @@
+import email.utils
+import threading
+import time
+
+# Requests per second allowed by each datasource: (per user, per datasource).
+# None means the datasource publishes no such limit.
+#   asana: 1500 requests per minute per token
+#   box: 10 requests per second per user
+#   onedrive: unpublished, stay conservative
+DEFAULT_RATES = {
+    'asana': (25.0, None),
+    'box': (10.0, None),
+    'onedrive': (10.0, None),
+}
+
+# Wait used when a datasource throttles us without saying for how long
+DEFAULT_RETRY_SECONDS = 60
+
+_LIMITERS = {}
+_DATASOURCE_BUCKETS = {}
+_LOCK = threading.Lock()
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket refilling at `rate` tokens per second.
+
+    The rate backs off whenever the datasource throttles us and creeps back
+    to the configured rate as requests succeed again.
+    """
+    def __init__(self, rate, capacity=None):
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.capacity = capacity or max(1.0, self.max_rate)
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.blocked_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Blocks until tokens are available and takes them.
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = max(self.blocked_until - now,
+                           (tokens - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def throttled(self, seconds=None):
+        """
+        Record a throttled request: back off, and if the datasource said how
+        long to wait, hand out no tokens until then.
+        """
+        with self._lock:
+            self.rate = max(self.max_rate / 10.0, self.rate / 2.0)
+            self.tokens = 0
+            if seconds:
+                self.blocked_until = max(self.blocked_until, time.time() + seconds)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100.0)
+
+    def retry_delay(self):
+        """
+        Seconds until the bucket hands out tokens again after a throttle.
+        """
+        return max(0, self.blocked_until - time.time())
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter(object):
+    """
+    Paces the requests of one user of a datasource.
+
+    Every request takes a token from the user's bucket and, if the
+    datasource has an overall limit, from the bucket shared by all its
+    users. Responses are fed back through `observe` so `Retry-After` and
+    rate limit headers stop requests until the datasource is ready again.
+    """
+    def __init__(self, user_bucket, datasource_bucket=None):
+        self.user_bucket = user_bucket
+        self.datasource_bucket = datasource_bucket
+
+    def acquire(self):
+        if self.datasource_bucket is not None:
+            self.datasource_bucket.acquire()
+        self.user_bucket.acquire()
+
+    def observe(self, status_code, headers):
+        """
+        Learn from a datasource response.
+
+        :param int status_code: HTTP status of the response
+        :param headers: Response headers (a case-insensitive mapping)
+        """
+        retry_after = retry_after_seconds(headers)
+
+        remaining = headers.get('X-RateLimit-Remaining')
+        if remaining is not None and remaining.strip() == '0':
+            retry_after = retry_after or _float(headers.get('X-RateLimit-Reset'))
+
+        if status_code == 429 or retry_after:
+            self.user_bucket.throttled(retry_after)
+        else:
+            self.user_bucket.succeeded()
+
+    def retry_delay(self, default=DEFAULT_RETRY_SECONDS):
+        """
+        Seconds to wait before syncing this user again after a rate limit
+        error, as last reported by the datasource.
+        """
+        return int(round(self.user_bucket.retry_delay())) or default
+
+
+def get_rate_limiter(datasource, user_key):
+    """
+    Returns the process-wide `RateLimiter` for a user of a datasource.
+
+    :param str datasource: Key of `DEFAULT_RATES`
+    :param user_key: Anything identifying the user's quota, typically their
+        credentials.
+    """
+    with _LOCK:
+        key = (datasource, user_key)
+        if key not in _LIMITERS:
+            user_rate, datasource_rate = DEFAULT_RATES[datasource]
+            if datasource_rate and datasource not in _DATASOURCE_BUCKETS:
+                _DATASOURCE_BUCKETS[datasource] = TokenBucket(datasource_rate)
+            _LIMITERS[key] = RateLimiter(TokenBucket(user_rate),
+                                         _DATASOURCE_BUCKETS.get(datasource))
+
+        return _LIMITERS[key]
+
+
+def retry_after_seconds(headers):
+    """
+    Parses a `Retry-After` header given either in seconds or as an HTTP date.
+
+    :returns float seconds, or None if the header is missing or invalid
+    """
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+
+    seconds = _float(value)
+    if seconds is not None:
+        return seconds
+
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0, email.utils.mktime_tz(parsed) - time.time())
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+__all__ = ['DEFAULT_RATES', 'DEFAULT_RETRY_SECONDS', 'RateLimiter',
+           'TokenBucket', 'get_rate_limiter', 'retry_after_seconds']
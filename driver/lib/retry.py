@@ -0,0 +1,129 @@
+import random
+import threading
+import time
+
+from .errors import ServiceUnavailableError
+
+_BREAKERS = {}
+_LOCK = threading.Lock()
+
+
+class CircuitOpenError(ServiceUnavailableError):
+    """
+    Raised instead of calling a datasource whose circuit breaker is open.
+    """
+    def __init__(self, datasource, duration_seconds):
+        super(CircuitOpenError, self).__init__(
+            'Circuit open for {}'.format(datasource))
+        self.datasource = datasource
+        self.duration_seconds = duration_seconds
+
+
+class CircuitBreaker(object):
+    """
+    Stops calls to a datasource after repeated failures.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    every call is refused for `reset_seconds`. Then a single trial call is
+    let through: success closes the circuit, failure opens it again.
+    """
+    def __init__(self, datasource, failure_threshold=5, reset_seconds=300):
+        self.datasource = datasource
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        :raises CircuitOpenError: if calls are currently refused
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+
+            remaining = self.opened_at + self.reset_seconds - time.time()
+            if remaining > 0:
+                raise CircuitOpenError(self.datasource, int(remaining) + 1)
+
+            # half open: let this call through, later callers wait for it
+            self.opened_at = time.time()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+
+
+class RetryPolicy(object):
+    """
+    Retries transient datasource failures with exponential backoff and full
+    jitter, optionally guarded by a `CircuitBreaker`.
+    """
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=300.0,
+                 retry_on=(ServiceUnavailableError,), breaker=None):
+        """
+        :param int max_attempts: Calls made before giving up, first included.
+        :param float base_delay: Upper bound of the first backoff, in seconds.
+        :param float max_delay: Cap on any single backoff, in seconds.
+        :param tuple retry_on: Exception types treated as transient.
+        :param breaker: Optional `CircuitBreaker` shared by every caller of
+            the same datasource.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+        self.breaker = breaker
+
+    def delay(self, attempt):
+        """
+        Backoff before retry number `attempt` (starting at 1).
+        """
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func until it succeeds, fails with a non transient error, or
+        `max_attempts` is reached; the last error is then re-raised.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.breaker is not None:
+                self.breaker.before_call()
+
+            try:
+                result = func(*args, **kwargs)
+            except self.retry_on as e:
+                if self.breaker is not None and not isinstance(e, CircuitOpenError):
+                    self.breaker.record_failure()
+                if attempt >= self.max_attempts or isinstance(e, CircuitOpenError):
+                    raise
+                time.sleep(self.delay(attempt))
+                continue
+
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return result
+
+
+def get_circuit_breaker(datasource):
+    """
+    Returns the process-wide `CircuitBreaker` of a datasource.
+    """
+    with _LOCK:
+        if datasource not in _BREAKERS:
+            _BREAKERS[datasource] = CircuitBreaker(datasource)
+        return _BREAKERS[datasource]
+
+__all__ = ['CircuitBreaker', 'CircuitOpenError', 'RetryPolicy',
+           'get_circuit_breaker']
@@ -0,0 +1,63 @@
+import io
+import os
+import tempfile
+
+# Downloads larger than this are spooled to disk instead of kept in memory
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+CHUNK_SIZE = 64 * 1024
+
+
+def spooled_file(max_memory=SPOOL_MAX_MEMORY):
+    """
+    Returns a file kept in memory until it grows past max_memory bytes.
+    """
+    return tempfile.SpooledTemporaryFile(max_size=max_memory)
+
+
+def spool(chunks, max_memory=SPOOL_MAX_MEMORY):
+    """
+    Write an iterable of byte chunks to a spooled file.
+
+    :returns the file, rewound
+    """
+    stream = spooled_file(max_memory)
+    for chunk in chunks:
+        if chunk:
+            stream.write(chunk)
+    stream.seek(0)
+    return stream
+
+
+def as_stream(data):
+    """
+    Returns data as a file-like object, wrapping bytes if needed.
+    """
+    if data is None or hasattr(data, 'read'):
+        return data
+    return io.BytesIO(data)
+
+
+def stream_size(stream):
+    """
+    Returns the size of a seekable stream, leaving it rewound.
+    """
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def iter_chunks(stream, chunk_size=CHUNK_SIZE):
+    """
+    Yields a stream's content from the start, chunk_size bytes at a time.
+    """
+    stream.seek(0)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+__all__ = ['CHUNK_SIZE', 'SPOOL_MAX_MEMORY', 'as_stream', 'iter_chunks',
+           'spool', 'spooled_file', 'stream_size']
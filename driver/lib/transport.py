@@ -0,0 +1,71 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connections kept open per host, for hosts not listed in POOL_SIZES
+DEFAULT_POOL_SIZE = 10
+
+# Connections kept open for the hosts the drivers talk to the most
+POOL_SIZES = {
+    'https://app.asana.com': 16,
+    'https://api.box.com': 16,
+    'https://dl.boxcloud.com': 16,
+    'https://api.onedrive.com': 16,
+}
+
+_TRANSPORTS = {}
+_LOCK = threading.Lock()
+
+
+class Transport(object):
+    """
+    Keep-alive HTTP connection pools shared by every driver of a process.
+
+    The pools live in the transport's adapters. `mount` installs them on an
+    SDK's own `requests.Session`, so the SDK keeps its authentication while
+    reusing connections opened by any other session. `session` is a plain
+    session on the same pools, for raw downloads.
+    """
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, pool_sizes=None):
+        """
+        :param int pool_size: Connections kept per host by default.
+        :param dict pool_sizes: Connections kept per URL prefix, overriding
+            pool_size. Defaults to `POOL_SIZES`.
+        """
+        self.adapters = {
+            'http://': HTTPAdapter(pool_maxsize=pool_size),
+            'https://': HTTPAdapter(pool_maxsize=pool_size),
+        }
+        for prefix, size in (POOL_SIZES if pool_sizes is None else pool_sizes).items():
+            self.adapters[prefix] = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+
+        self.session = self.mount(requests.Session())
+
+    def mount(self, session):
+        """
+        Route a session's requests through the shared pools.
+
+        :returns session
+        """
+        for prefix, adapter in self.adapters.items():
+            session.mount(prefix, adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        session.headers['Connection'] = 'keep-alive'
+        return session
+
+    def close(self):
+        for adapter in self.adapters.values():
+            adapter.close()
+
+
+def get_transport():
+    """
+    Returns the process-wide `Transport`.
+    """
+    with _LOCK:
+        if 'transport' not in _TRANSPORTS:
+            _TRANSPORTS['transport'] = Transport()
+        return _TRANSPORTS['transport']
+
+__all__ = ['DEFAULT_POOL_SIZE', 'POOL_SIZES', 'Transport', 'get_transport']
@@ -2,12 +2,15 @@
 
 # stdlib imports
 from collections import deque
+import copy
 import datetime
+import json
 import os
 import tempfile
 import time
 # third-party imports
 import onedrivesdk
+from onedrivesdk.http_response import HttpResponse
 import dateparser
 import pytz
 import requests
@@ -17,6 +20,10 @@ from lib import RateLimitError
 from lib import RetrieveDataResult
 from lib import RetrieveMetadataResult
 from lib import ServiceUnavailableError
+from lib import merge_metadata_pages
+from lib.ratelimit import get_rate_limiter
+from lib.stream import CHUNK_SIZE
+from lib.transport import get_transport
 
 
 def parse_date(s):
@@ -53,6 +60,18 @@ def parse_datetime(s):
     return dt
 
 
+def content_version(item):
+    """
+    Returns a fingerprint of a file's content: its SHA-1 when OneDrive
+    reports one, else its cTag, which only changes with the content.
+    """
+    hashes = item.file.hashes if item.file else None
+    if hashes is not None and hashes.sha1_hash:
+        return hashes.sha1_hash
+
+    return item.c_tag
+
+
 class OneDriveSession(onedrivesdk.session.Session):
 
     @staticmethod
@@ -66,14 +85,83 @@ class OneDriveSession(onedrivesdk.session.Session):
 
     pass
 
+class PacedHttpProvider(onedrivesdk.HttpProvider):
+    """
+    OneDrive HTTP provider that waits for a rate limiter before every request
+    and reports every response back to it.
+
+    The stock provider opens a new session for every request; this one keeps
+    a session of its own, mounted on the shared connection pools, so no
+    cookies are shared with other accounts.
+    """
+
+    def __init__(self, rate_limiter):
+        super(PacedHttpProvider, self).__init__()
+        self.rate_limiter = rate_limiter
+        self.session = get_transport().mount(requests.Session())
+        return
+
+    def _request(self, method, url, headers, **kwargs):
+        """
+        :raises ServiceUnavailableError: on connection failures and 5xx
+            responses
+        """
+        self.rate_limiter.acquire()
+        try:
+            response = self.session.request(method, url, headers=headers, **kwargs)
+        except (requests.ConnectionError, requests.Timeout), e:
+            raise ServiceUnavailableError( e )
+        self.rate_limiter.observe(response.status_code, response.headers)
+
+        if response.status_code >= 500:
+            response.close()
+            raise ServiceUnavailableError( 'OneDrive answered {}'.format(response.status_code) )
+        return response
+
+    def send(self, method, headers, url, data=None, content=None, path=None):
+        if path:
+            with open(path, mode='rb') as f:
+                response = self._request(method, url, headers, files={'file': f})
+        else:
+            response = self._request(method, url, headers,
+                                     data=json.dumps(content) if content else data)
+
+        return HttpResponse(response.status_code, response.headers, response.text)
+
+    def download(self, headers, url, path):
+        response = self._request('GET', url, headers, stream=True)
+        try:
+            if response.status_code != 200:
+                return HttpResponse(response.status_code, response.headers, response.text)
+
+            with open(path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if chunk:
+                        f.write(chunk)
+
+            return HttpResponse(response.status_code, response.headers, None)
+        finally:
+            response.close()
+
+    pass
+
 class OneDriveDriver(object):
 
+    DATASOURCE = 'onedrive'
     API_BASE_URL = 'https://api.onedrive.com/v1.0/'
     REDIRECT_URL = 'https://pembo13.net/'
     SCOPES = ['wl.signin', 'wl.offline_access', 'onedrive.readwrite']
 
-    def __init__(self, **credentials):
+    def __init__(self, datasource_user_id=None, **credentials):
+        """
+        :param datasource_user_id: OneDrive account the credentials belong
+            to. Its requests are paced by a rate limiter kept under this id;
+            OneDrive hands out a new refresh token on every refresh, so
+            long-lived callers must pass it. Defaults to the current refresh
+            token.
+        """
         self.credentials = credentials
+        self.rate_limiter = get_rate_limiter(OneDriveDriver.DATASOURCE, datasource_user_id or credentials.get('refresh_token'))
 
         # initialize some fields
         self.client = None
@@ -108,11 +196,11 @@ class OneDriveDriver(object):
                 fd,path = tempfile.mkstemp()
                 os.close(fd)
 
-                self.client.item(drive='me', id=external_id).download(path)
-
                 try:
-                    with open(path, 'rb') as fin:
-                        return RetrieveDataResult(data=fin.read())
+                    self.client.item(drive='me', id=external_id).download(path)
+
+                    # the open file outlives its removed path
+                    return RetrieveDataResult(data=open(path, 'rb'))
                 finally:
                     if os.path.isfile(path):
                         os.remove(path)
@@ -120,15 +208,18 @@ class OneDriveDriver(object):
             if e.code == onedrivesdk.error.ErrorCode.AccessDenied:
                 raise AuthRevokedError( e.message )
             if e.code == onedrivesdk.error.ErrorCode.ActivityLimitReached:
-                raise RateLimitError( e.message )
+                raise RateLimitError( e.message, duration_seconds=self.rate_limiter.retry_delay() )
             if e.code == onedrivesdk.error.ErrorCode.Unauthenticated:
                 raise AuthRevokedError( e.message )
+            if e.code == onedrivesdk.error.ErrorCode.ItemNotFound:
+                # the file was deleted since it was crawled
+                return RetrieveDataResult(data=None, should_remove_doc=True)
 
             raise
 
         return
 
-    def retrieve_metadata(self, milestone):
+    def retrieve_metadata(self, milestone, budget=None):
         """
         This function gathers the file manifest from the datasource. The only
         focus here is the metadata, such as name, container, mimetype, etc. No
@@ -139,21 +230,38 @@ class OneDriveDriver(object):
             identifier that will allow the subsequent run to pick up indexing
             files where it last left off.
 
+        :param budget: Optional `Budget`. Once it is used up the sync stops
+            at the next page boundary with retrieve_metadata_done=False.
+
         :returns `RetrieveMetadataResult` with the appropriate values populated.
         """
-        docs = []
+        return merge_metadata_pages(self.retrieve_metadata_pages(milestone, budget=budget), milestone)
+
+    def retrieve_metadata_pages(self, milestone, page_size=None, budget=None):
+        """
+        Same as `retrieve_metadata`, but yields a `RetrieveMetadataResult` per
+        delta page. OneDrive picks the page size, so page_size is ignored.
 
+        The delta token is stored in milestone['token'] after every page, so
+        an interrupted sync, or one stopped by the budget, resumes from the
+        next page.
+        """
         try:
             # get delta token
             token = milestone.get('token')
 
             collection_page_empty = False
             while not collection_page_empty:
+                if budget is not None and budget.exhausted:
+                    return
+
+                if budget is not None: budget.spend()
                 collection_page = self.client.item(drive='me', id='root').delta(token=token).get()
 
                 collection_page_empty = len(collection_page) == 0
                 token = collection_page.token
 
+                docs = []
                 for item in collection_page:
                     # build document meta for task
                     path = filter(None, item.parent_reference.path.replace(u'/drive/root:', u'').split(u'/'))
@@ -173,29 +281,32 @@ class OneDriveDriver(object):
                         'created': item.created_date_time,
                         'edited': item.last_modified_date_time,
                         'parent_name' : path[-1] if path else '',
+                        'content_version': content_version(item),
                     }
                     docs.append(doc)
                     pass
-                pass
 
-            # update milestone
-            milestone['token'] = token
+                # update milestone
+                milestone['token'] = token
 
-            # build result object
-            result = RetrieveMetadataResult(
-                milestone=milestone,
-                retrieve_metadata_done=True,
-                docs=docs
-            )
+                # build result object
+                yield RetrieveMetadataResult(
+                    milestone=copy.deepcopy(milestone),
+                    retrieve_metadata_done=collection_page_empty,
+                    docs=docs
+                )
+                pass
         except onedrivesdk.error.OneDriveError, e:
             if e.code == onedrivesdk.error.ErrorCode.AccessDenied:
                 raise AuthRevokedError( e.message )
             if e.code == onedrivesdk.error.ErrorCode.ActivityLimitReached:
-                raise RateLimitError( e.message )
+                raise RateLimitError( e.message, duration_seconds=self.rate_limiter.retry_delay() )
             if e.code == onedrivesdk.error.ErrorCode.Unauthenticated:
                 raise AuthRevokedError( e.message )
 
-        return result
+            raise
+
+        return
 
     def setup(self):
         """
@@ -226,7 +337,7 @@ class OneDriveDriver(object):
             client_secret=self.credentials.get('client_secret')
         )
 
-        http_provider = onedrivesdk.HttpProvider()
+        http_provider = PacedHttpProvider(self.rate_limiter)
         self.oauth = onedrivesdk.AuthProvider(
             http_provider=http_provider,
             client_id=self.credentials.get('client_id'),
@@ -30,6 +30,8 @@ FILE_REFERENCE = {
 }
 
 class SampleDriver():
+    DATASOURCE = 'sample'
+
     def __init__(self, butter_user_id, datasource_user_id):
         self.butter_user_id = butter_user_id
         self.datasource_user_id = datasource_user_id
@@ -74,5 +76,5 @@ class SampleDriver():
 
         :return `RetrieveDataResult` with the appropriate values populated.
         """
-        f = open(os.path.dirname(__file__) + "/lib/sample_data/"+FILE_REFERENCE[doc['id']], 'r')
-        return RetrieveDataResult(data=f.read())
+        f = open(os.path.dirname(__file__) + "/lib/sample_data/"+FILE_REFERENCE[doc['id']], 'rb')
+        return RetrieveDataResult(data=f)
@@ -0,0 +1,208 @@
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+import zlib
+
+from concurrent import futures
+
+# local imports
+from driver_wrapper import ETLTaskLite
+from lib.db import get_datasources, acquire_lease, release_lease, reset_conn
+from lib.extraction.server import TikaPool, TikaUnavailableError
+from sample_driver import SampleDriver
+
+
+class Scheduler(object):
+    """
+    Keeps every datasource in the milestone store in sync from one process.
+
+    Each pass runs an `ETLTaskLite` for every user whose milestone does not
+    postpone it, on a pool of `workers` threads. The docstore connection
+    and the pool of Tika servers are shared by all tasks.
+
+    Several schedulers can split the users between them: each one only
+    looks at the users hashing to its `shard` out of `shards`, and holds a
+    lease on a user while syncing it so no two schedulers ever sync the same
+    account. A lease left behind by a dead scheduler expires after
+    `lease_seconds` and can then be taken over.
+    """
+    def __init__(self, driver_factory, workers=4, interval=60, task_options=None,
+                 shard=0, shards=1, lease_seconds=300):
+        """
+        :param driver_factory: Called with (butter_user_id, datasource_user_id)
+            to build the driver for a task. Drivers that pace requests per
+            account should be given the datasource_user_id to key them by.
+        :param int workers: Number of tasks run at the same time.
+        :param int interval: Seconds between the start of two passes.
+        :param dict task_options: Extra keyword arguments for `ETLTaskLite`.
+        :param int shard: Index of the users partition this scheduler runs.
+        :param int shards: Number of partitions users are split into.
+        :param int lease_seconds: Lifetime of a user lease. Leases are renewed
+            while their task runs.
+        """
+        self.driver_factory = driver_factory
+        self.workers = workers
+        self.interval = interval
+        self.task_options = dict(task_options or {})
+        self.shard = shard
+        self.shards = shards
+        self.lease_seconds = lease_seconds
+        self.owner = '{}:{}:{}'.format(socket.gethostname(), os.getpid(),
+                                       uuid.uuid4().hex)
+
+    def eligible(self):
+        """
+        Returns this shard's (butter_user_id, datasource_user_id) pairs due for
+        a sync.
+        """
+        now = int(time.time())
+        return [(row['butter_user_id'], row['datasource_user_id'])
+                for row in get_datasources()
+                if row['milestone'].get('next-sync', 0) < now and
+                shard_of(row['butter_user_id'], row['datasource_user_id'],
+                         self.shards) == self.shard]
+
+    def run_once(self):
+        """
+        Run one task for every eligible user and wait for all of them.
+
+        A failing task is reported and does not stop the others.
+
+        :returns int number of tasks that ran
+        """
+        users = self.eligible()
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for future in [executor.submit(self.run_task, *user) for user in users]:
+                future.result()
+
+        return len(users)
+
+    def run_forever(self):
+        extract_workers = self.task_options.get('extract_workers') or \
+                          multiprocessing.cpu_count()
+        with TikaPool(extract_workers) as extractor:
+            try:
+                extractor.start()
+            except TikaUnavailableError as tika_error:
+                # servers that failed are started again on the first doc
+                print('Tika servers failed to start: {}'.format(tika_error.error))
+            self.task_options['extractor'] = extractor
+            while True:
+                started = time.time()
+                count = self.run_once()
+                print('ran {} tasks in {:.1f}s'.format(count, time.time() - started))
+                time.sleep(max(0, self.interval - (time.time() - started)))
+
+    def run_task(self, butter_user_id, datasource_user_id):
+        if not acquire_lease(butter_user_id, datasource_user_id, self.owner,
+                             self.lease_seconds):
+            return
+
+        heartbeat = LeaseHeartbeat(butter_user_id, datasource_user_id,
+                                   self.owner, self.lease_seconds)
+        heartbeat.start()
+        try:
+            driver = self.driver_factory(butter_user_id, datasource_user_id)
+            if hasattr(driver, '__enter__'):
+                with driver:
+                    self._start(butter_user_id, datasource_user_id, driver)
+            else:
+                self._start(butter_user_id, datasource_user_id, driver)
+        except Exception:
+            print('task for {} / {} failed'.format(butter_user_id, datasource_user_id))
+            traceback.print_exc()
+        finally:
+            heartbeat.stop()
+            release_lease(butter_user_id, datasource_user_id, self.owner)
+
+    def _start(self, butter_user_id, datasource_user_id, driver):
+        task = ETLTaskLite(butter_user_id, datasource_user_id, driver,
+                           **self.task_options)
+        task.start()
+
+
+class LeaseHeartbeat(threading.Thread):
+    """
+    Renews a user lease in the background until stopped.
+    """
+    def __init__(self, butter_user_id, datasource_user_id, owner, ttl):
+        super(LeaseHeartbeat, self).__init__()
+        self.daemon = True
+        self.butter_user_id = butter_user_id
+        self.datasource_user_id = datasource_user_id
+        self.owner = owner
+        self.ttl = ttl
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.ttl / 3.0):
+            acquire_lease(self.butter_user_id, self.datasource_user_id,
+                          self.owner, self.ttl)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def shard_of(butter_user_id, datasource_user_id, shards):
+    """
+    Returns the partition a user belongs to, stable across processes.
+    """
+    key = u'{}:{}'.format(butter_user_id, datasource_user_id).encode('utf-8')
+    return (zlib.crc32(key) & 0xffffffff) % shards
+
+
+def run_sharded(driver_factory, processes=None, **options):
+    """
+    Run one scheduler process per shard, restarting any that dies.
+
+    Each process gets an equal share of the cores for Tika servers unless
+    `task_options` says otherwise. A restarted shard picks its users back up
+    once the leases of the dead process expire.
+
+    A Tika server is started and health checked before any shard is
+    spawned, so a missing jar or a broken JVM stops the run right away.
+
+    :raises TikaUnavailableError: if no Tika server could be started
+
+    :param int processes: Number of shards. Defaults to the number of cores.
+    :param options: Extra keyword arguments for `Scheduler`.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    task_options = dict(options.pop('task_options', None) or {})
+    task_options.setdefault('extract_workers',
+                            max(1, multiprocessing.cpu_count() // processes))
+
+    # also fetches the jar once, before the shards would race for it
+    with TikaPool() as extractor:
+        extractor.start()
+
+    def spawn(shard):
+        worker = multiprocessing.Process(target=_run_shard,
+                                         args=(driver_factory, shard, processes,
+                                               task_options, options))
+        worker.start()
+        return worker
+
+    workers = [spawn(shard) for shard in range(processes)]
+    while True:
+        for shard, worker in enumerate(workers):
+            worker.join(1)
+            if not worker.is_alive():
+                print('shard {} exited with {}, restarting'.format(shard, worker.exitcode))
+                workers[shard] = spawn(shard)
+
+
+def _run_shard(driver_factory, shard, shards, task_options, options):
+    # the parent's sqlite connection must not be used across a fork
+    reset_conn()
+    Scheduler(driver_factory, task_options=task_options, shard=shard,
+              shards=shards, **options).run_forever()
+
+
+if __name__ == '__main__':
+    run_sharded(SampleDriver)
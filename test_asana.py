@@ -7,6 +7,7 @@ import sys
 # third-party imports
 # local imports
 from driver.asana_driver import AsanaDriver
+from driver.lib.stream import stream_size
 
 
 pp = pprint.PrettyPrinter(indent=4)
@@ -47,7 +48,7 @@ def test():
         
         print 'File:',
         result = driver.retrieve_data({ 'external_id': 431133620991715 , 'subtype': 'attachment' })
-        print len(result.data), 'bytes'
+        print stream_size(result.data), 'bytes'
         pass
     return
 
@@ -0,0 +1,131 @@
+# stdlib imports
+import datetime
+import json
+import unittest
+# third-party imports
+import requests
+# local imports
+from driver.asana_driver import AsanaDriver, PacedClient
+from driver.lib import ServiceUnavailableError
+from driver.lib.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+def response(status_code, payload=None):
+    r = requests.Response()
+    r.status_code = status_code
+    r._content = json.dumps(payload or {})
+    return r
+
+
+class FakeSession(object):
+    """
+    Answers every request with the next queued response.
+    """
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.urls = []
+
+    def get(self, url, **kwargs):
+        self.urls.append(url)
+        return self.responses.pop(0)
+
+
+class FakeRateLimiter(object):
+
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+
+class PacedClientTest(unittest.TestCase):
+
+    def test_request_waits_for_rate_limiter(self):
+        session = FakeSession(response(200, {'data': {'id': 1}}))
+        client = PacedClient(session=session)
+        client.rate_limiter = FakeRateLimiter()
+
+        self.assertEqual(client.request('get', '/users/me'), {'id': 1})
+        self.assertEqual(client.rate_limiter.acquired, 1)
+        self.assertEqual(len(session.urls), 1)
+        self.assertTrue(session.urls[0].endswith('/users/me'))
+
+
+class AsanaDriverTest(unittest.TestCase):
+
+    def driver(self, session):
+        driver = AsanaDriver('token')
+        # no retries inside the SDK, failures go to the retry policy
+        driver.client = PacedClient(session=session, max_retries=0)
+        return driver
+
+    def test_server_error_is_service_unavailable(self):
+        driver = self.driver(FakeSession(response(503)))
+
+        with self.assertRaises(ServiceUnavailableError):
+            driver.retrieve_data({'external_id': 1, 'subtype': 'attachment'})
+
+    def test_server_errors_open_circuit(self):
+        session = FakeSession(*[response(500) for _ in range(10)])
+        driver = self.driver(session)
+        breaker = CircuitBreaker('asana-test', failure_threshold=3)
+        policy = RetryPolicy(max_attempts=5, base_delay=0, breaker=breaker)
+
+        with self.assertRaises(CircuitOpenError):
+            policy.call(driver.retrieve_data, {'external_id': 1, 'subtype': 'attachment'})
+        self.assertEqual(len(session.urls), 3)
+
+    def test_deleted_attachment_is_removed(self):
+        driver = self.driver(FakeSession(response(404)))
+
+        result = driver.retrieve_data({'external_id': 1, 'subtype': 'attachment'})
+        self.assertIsNone(result.data)
+        self.assertTrue(result.should_remove_doc)
+
+
+class FakeAttachments(object):
+
+    def __init__(self, attachments):
+        self.attachments = attachments
+
+    def find_by_task(self, task, fields=None):
+        return list(self.attachments)
+
+
+class FakeClient(object):
+
+    def __init__(self, attachments):
+        self.attachments = FakeAttachments(attachments)
+
+
+class TaskDocsTest(unittest.TestCase):
+
+    TASK = {
+        'id': 1, 'name': 'task', 'notes': '', 'projects': [{'id': 2, 'name': 'project'}],
+        'created_at': '2017-01-01T00:00:00.000Z', 'modified_at': '2017-03-01T00:00:00.000Z',
+        'completed': False, 'completed_at': None, 'due_at': None, 'due_on': None,
+        'hearted': False, 'tags': [], 'assignee': None, 'parent': None,
+    }
+
+    def setUp(self):
+        self.driver = AsanaDriver('token')
+        self.driver.client = FakeClient([
+            {'id': 10, 'name': 'old.pdf', 'created_at': '2017-01-02T00:00:00.000Z',
+             'parent': {'name': 'task'}},
+            {'id': 11, 'name': 'new.pdf', 'created_at': '2017-02-15T00:00:00.000Z',
+             'parent': {'name': 'task'}},
+        ])
+
+    def test_lists_every_attachment(self):
+        docs = self.driver._task_docs(dict(self.TASK))
+        self.assertEqual([d['external_id'] for d in docs], [1, 10, 11])
+
+    def test_skips_attachments_listed_before(self):
+        since = self.driver._attachments_since(datetime.datetime(2017, 2, 1).isoformat())
+        docs = self.driver._task_docs(dict(self.TASK), since)
+        self.assertEqual([d['external_id'] for d in docs], [1, 11])
+
+
+if __name__ == '__main__':
+    unittest.main()
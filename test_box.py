@@ -9,6 +9,7 @@ import urlparse
 import boxsdk
 # local imports
 from driver.box_driver import BoxDriver
+from driver.lib.stream import stream_size
 
 
 REDIRECT_URL = 'https://pembo13.net/'
@@ -103,7 +104,7 @@ def test():
             
         print 'File:',
         result = driver.retrieve_data({ 'external_id': 232814289172 })
-        print len(result.data), 'bytes'
+        print stream_size(result.data), 'bytes'
         pass
     return
 
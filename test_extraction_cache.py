@@ -0,0 +1,56 @@
+# stdlib imports
+import os
+import shutil
+import tempfile
+import time
+import unittest
+# local imports
+from driver.lib.extraction.cache import ExtractionCache
+
+
+def result(size):
+    return {'status': 200, 'metadata': {}, 'content': u'x' * size}
+
+
+class ExtractionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_and_put(self):
+        cache = ExtractionCache(self.path)
+        self.assertIsNone(cache.get('a', 10))
+
+        cache.put('a', result(1))
+        self.assertEqual(cache.get('a', 10), result(1))
+        self.assertEqual((cache.hits, cache.misses, cache.bytes_saved), (1, 1, 10))
+
+    def test_evicts_least_recently_used(self):
+        cache = ExtractionCache(self.path, max_bytes=3000)
+        for digest in 'abc':
+            cache.put(digest, result(800))
+            time.sleep(0.01)
+        cache.get('a')
+
+        cache.put('d', result(800))
+
+        self.assertIsNone(cache.get('b'))
+        for digest in 'acd':
+            self.assertIsNotNone(cache.get(digest))
+
+    def test_counts_existing_results_on_open(self):
+        ExtractionCache(self.path).put('a', result(900))
+
+        cache = ExtractionCache(self.path, max_bytes=1500)
+        cache.put('b', result(900))
+
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
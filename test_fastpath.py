@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# stdlib imports
+from io import BytesIO
+import unittest
+# local imports
+from driver.lib.extraction import fastpath
+from driver.lib.extraction.fastpath import fast_extract, fast_format
+
+
+def content(data, mime=None, name='doc.txt'):
+    result = fast_extract(BytesIO(data), mime, name)
+    return result and result['content']
+
+
+class FastFormatTest(unittest.TestCase):
+
+    def test_mime_wins_over_name(self):
+        self.assertEqual(fast_format('text/csv; charset=utf-8', 'doc.txt'), 'csv')
+
+    def test_name(self):
+        self.assertEqual(fast_format(None, 'Page.HTML'), 'html')
+
+    def test_needs_tika(self):
+        self.assertIsNone(fast_format('application/pdf', 'doc.pdf'))
+        self.assertIsNone(fast_format(None, None))
+
+
+class FastExtractTest(unittest.TestCase):
+
+    def test_utf8(self):
+        self.assertEqual(content('caf\xc3\xa9'), u'café')
+        self.assertEqual(content('\xef\xbb\xbfcaf\xc3\xa9'), u'café')
+
+    def test_utf16_and_utf32(self):
+        self.assertEqual(content(u'café'.encode('utf-16')), u'café')
+        self.assertEqual(content('\xfe\xff' + u'hi'.encode('utf-16-be')), u'hi')
+        self.assertEqual(content(u'café'.encode('utf-32')), u'café')
+
+    def test_malformed_utf16_goes_to_tika(self):
+        self.assertIsNone(content('\xff\xfe h\x00i\x00'))
+
+    def test_other_encodings_go_to_tika(self):
+        stream = BytesIO('caf\xe9')
+        self.assertIsNone(fast_extract(stream, None, 'doc.txt'))
+        self.assertEqual(stream.tell(), 0)
+
+    def test_nul_characters_go_to_tika(self):
+        self.assertIsNone(content('h\x00i\x00'))
+
+    def test_unknown_format_goes_to_tika(self):
+        self.assertIsNone(content('%PDF-1.4', 'application/pdf', 'doc.pdf'))
+
+    def test_large_documents_go_to_tika(self):
+        self.assertIsNone(content('a' * (fastpath.MAX_FAST_BYTES + 1)))
+
+    def test_csv(self):
+        self.assertEqual(content('a,b\n"c d",e\n', name='doc.csv'), u'a b\nc d e')
+
+    def test_json(self):
+        self.assertEqual(content('{"key": ["one", 2, "two"]}', name='doc.json'),
+                         u'key\none\ntwo')
+
+    def test_malformed_json_keeps_raw_text(self):
+        self.assertEqual(content('{"key"', name='doc.json'), u'{"key"')
+
+    def test_html(self):
+        result = fast_extract(BytesIO('<html><head><title>Title</title>'
+                                      '<script>var x;</script></head>'
+                                      '<body><p>Hello &amp; <b>bye</b></p></body></html>'),
+                              'text/html', None)
+        self.assertEqual(result['content'], u'Hello & bye')
+        self.assertEqual(result['metadata']['title'], u'Title')
+        self.assertEqual(result['metadata']['Content-Type'], 'text/html')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+# stdlib imports
+import unittest
+# local imports
+from driver.lib import RetrieveMetadataResult, merge_metadata_pages
+
+
+class MergeMetadataPagesTest(unittest.TestCase):
+
+    def test_pages_are_concatenated(self):
+        pages = [
+            RetrieveMetadataResult(milestone={'offset': 1},
+                                   docs=[{'id': 'a'}],
+                                   doc_ids_to_remove=['x']),
+            RetrieveMetadataResult(milestone={'offset': 2},
+                                   docs=[{'id': 'b'}, {'id': 'c'}],
+                                   retrieve_metadata_done=True),
+        ]
+        result = merge_metadata_pages(iter(pages), {'offset': 0})
+
+        self.assertEqual(result.docs, [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}])
+        self.assertEqual(result.doc_ids_to_remove, ['x'])
+        self.assertEqual(result.milestone, {'offset': 2})
+        self.assertTrue(result.retrieve_metadata_done)
+
+    def test_last_page_decides_done(self):
+        pages = [
+            RetrieveMetadataResult(milestone={'offset': 1}, retrieve_metadata_done=True),
+            RetrieveMetadataResult(milestone={'offset': 2}),
+        ]
+        result = merge_metadata_pages(iter(pages), {'offset': 0})
+
+        self.assertEqual(result.milestone, {'offset': 2})
+        self.assertFalse(result.retrieve_metadata_done)
+
+    def test_no_pages_keeps_milestone(self):
+        milestone = {'offset': 0}
+        result = merge_metadata_pages(iter([]), milestone)
+
+        self.assertIs(result.milestone, milestone)
+        self.assertEqual(result.docs, [])
+        self.assertFalse(result.retrieve_metadata_done)
+
+
+if __name__ == '__main__':
+    unittest.main()
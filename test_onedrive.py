@@ -10,6 +10,7 @@ import urlparse
 import onedrivesdk
 # local imports
 from driver.onedrive_driver import OneDriveDriver
+from driver.lib.stream import stream_size
 
 
 API_BASE_URL = 'https://api.onedrive.com/v1.0/'
@@ -158,7 +159,7 @@ def test():
             
         print 'File:',
         result = driver.retrieve_data({ 'external_id': '7794AF724FC1B738!102' })
-        print len(result.data), 'bytes'
+        print stream_size(result.data), 'bytes'
         pass
     return
 
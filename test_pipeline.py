@@ -0,0 +1,70 @@
+# stdlib imports
+import threading
+import unittest
+# local imports
+from driver.lib.pipeline import Pipeline, Stage
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_runs_every_item_through_every_stage(self):
+        stored = []
+        lock = threading.Lock()
+
+        def store(item):
+            with lock:
+                stored.append(item)
+
+        pipeline = Pipeline([Stage('double', lambda x: x * 2, workers=3),
+                             Stage('increment', lambda x: x + 1, workers=2),
+                             Stage('store', store)],
+                            queue_size=2)
+        stats = pipeline.run(range(100))
+
+        self.assertEqual(sorted(stored), [x * 2 + 1 for x in range(100)])
+        self.assertEqual([s.name for s in stats], ['double', 'increment', 'store'])
+        self.assertEqual([s.items for s in stats], [100, 100, 100])
+        for s in stats:
+            self.assertIsNotNone(s.finished)
+
+    def test_empty_input(self):
+        stats = Pipeline([Stage('noop', lambda x: x, workers=2)]).run([])
+        self.assertEqual(stats[0].items, 0)
+
+    def test_error_aborts_and_is_reraised(self):
+        fed = []
+
+        def items():
+            for x in range(1000):
+                fed.append(x)
+                yield x
+
+        def fail(x):
+            if x == 5:
+                raise KeyError(x)
+            return x
+
+        stored = []
+        pipeline = Pipeline([Stage('fail', fail, workers=2),
+                             Stage('store', stored.append)],
+                            queue_size=1)
+
+        with self.assertRaises(KeyError):
+            pipeline.run(items())
+
+        # the feed stopped early and items past the failure were drained
+        self.assertLess(len(fed), 1000)
+        self.assertNotIn(5, stored)
+
+    def test_first_error_wins(self):
+        def fail(x):
+            raise ValueError(x)
+
+        pipeline = Pipeline([Stage('fail', fail, workers=4)], queue_size=1)
+
+        with self.assertRaises(ValueError):
+            pipeline.run(range(50))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# stdlib imports
+import email.utils
+import time
+import unittest
+# local imports
+from driver.lib.ratelimit import RateLimiter, TokenBucket, get_rate_limiter, retry_after_seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_starts_full(self):
+        bucket = TokenBucket(5)
+        started = time.time()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertLess(time.time() - started, 0.1)
+        self.assertLess(bucket.tokens, 1)
+
+    def test_waits_for_refill(self):
+        bucket = TokenBucket(50, capacity=1)
+        bucket.acquire()
+        started = time.time()
+        bucket.acquire()
+        self.assertGreaterEqual(time.time() - started, 0.01)
+
+    def test_throttle_backs_off_and_recovers(self):
+        bucket = TokenBucket(10)
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 5)
+        self.assertEqual(bucket.tokens, 0)
+
+        for _ in range(10):
+            bucket.throttled()
+        self.assertEqual(bucket.rate, 1)
+
+        for _ in range(1000):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 10)
+
+    def test_throttle_blocks_for_given_seconds(self):
+        bucket = TokenBucket(10)
+        self.assertEqual(bucket.retry_delay(), 0)
+
+        bucket.throttled(30)
+        self.assertAlmostEqual(bucket.retry_delay(), 30, delta=1)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_observe(self):
+        limiter = RateLimiter(TokenBucket(10))
+        limiter.observe(200, {})
+        self.assertEqual(limiter.retry_delay(), 60)
+
+        limiter.observe(429, {'Retry-After': '120'})
+        self.assertEqual(limiter.user_bucket.rate, 5)
+        self.assertAlmostEqual(limiter.retry_delay(), 120, delta=1)
+
+    def test_observe_exhausted_quota(self):
+        limiter = RateLimiter(TokenBucket(10))
+        limiter.observe(200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '45'})
+        self.assertAlmostEqual(limiter.retry_delay(), 45, delta=1)
+
+    def test_limiters_are_shared_per_user(self):
+        limiter = get_rate_limiter('box', 'test-user')
+        self.assertIs(get_rate_limiter('box', 'test-user'), limiter)
+        self.assertIsNot(get_rate_limiter('box', 'other-user'), limiter)
+
+
+class RetryAfterSecondsTest(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(retry_after_seconds({'Retry-After': '7'}), 7)
+
+    def test_http_date(self):
+        value = email.utils.formatdate(time.time() + 90, usegmt=True)
+        self.assertAlmostEqual(retry_after_seconds({'Retry-After': value}), 90, delta=2)
+
+    def test_missing_or_invalid(self):
+        self.assertIsNone(retry_after_seconds(None))
+        self.assertIsNone(retry_after_seconds({}))
+        self.assertIsNone(retry_after_seconds({'Retry-After': 'soon'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
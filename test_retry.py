@@ -0,0 +1,88 @@
+# stdlib imports
+import unittest
+# local imports
+from driver.lib import ServiceUnavailableError
+from driver.lib.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+class Flaky(object):
+    """
+    Fails with error the first `failures` calls, then returns 'ok'.
+    """
+    def __init__(self, failures, error=ServiceUnavailableError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error('down')
+        return 'ok'
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_retries_until_success(self):
+        func = Flaky(2)
+        self.assertEqual(RetryPolicy(base_delay=0).call(func), 'ok')
+        self.assertEqual(func.calls, 3)
+
+    def test_gives_up_after_max_attempts(self):
+        func = Flaky(10)
+        with self.assertRaises(ServiceUnavailableError):
+            RetryPolicy(max_attempts=3, base_delay=0).call(func)
+        self.assertEqual(func.calls, 3)
+
+    def test_other_errors_are_not_retried(self):
+        func = Flaky(1, error=KeyError)
+        with self.assertRaises(KeyError):
+            RetryPolicy(base_delay=0).call(func)
+        self.assertEqual(func.calls, 1)
+
+    def test_delay_is_capped(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=10.0)
+        for attempt in range(1, 20):
+            self.assertTrue(0 <= policy.delay(attempt) <= min(10.0, 2 ** (attempt - 1)))
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker('test', failure_threshold=3, reset_seconds=300)
+        func = Flaky(10)
+        policy = RetryPolicy(max_attempts=10, base_delay=0, breaker=breaker)
+
+        with self.assertRaises(CircuitOpenError) as raised:
+            policy.call(func)
+        self.assertEqual(func.calls, 3)
+        self.assertGreater(raised.exception.duration_seconds, 0)
+
+        # refused without calling
+        with self.assertRaises(CircuitOpenError):
+            policy.call(func)
+        self.assertEqual(func.calls, 3)
+
+    def test_trial_call_closes_circuit(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_seconds=0)
+        breaker.record_failure()
+        self.assertIsNotNone(breaker.opened_at)
+
+        policy = RetryPolicy(max_attempts=1, base_delay=0, breaker=breaker)
+        self.assertEqual(policy.call(Flaky(0)), 'ok')
+        self.assertIsNone(breaker.opened_at)
+        self.assertEqual(breaker.failures, 0)
+
+    def test_failed_trial_call_reopens_circuit(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_seconds=0)
+        breaker.record_failure()
+
+        policy = RetryPolicy(max_attempts=1, base_delay=0, breaker=breaker)
+        with self.assertRaises(ServiceUnavailableError):
+            policy.call(Flaky(1))
+        self.assertIsNotNone(breaker.opened_at)
+        self.assertEqual(breaker.failures, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
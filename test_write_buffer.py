@@ -0,0 +1,94 @@
+# stdlib imports
+import os
+import sys
+import unittest
+# third-party imports
+from pymongo import DeleteOne, UpdateOne
+# local imports
+# the docstore schema is loaded from the top-level `lib` package, as it is
+# when running from driver/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'driver'))
+from lib.docstore.base import DocstoreWriteBuffer
+
+
+class FakeCollection(object):
+    """
+    Records the batches sent to bulk_write.
+    """
+    def __init__(self):
+        self.batches = []
+
+    def bulk_write(self, requests, ordered=True):
+        self.batches.append(list(requests))
+
+
+class FakeDocstore(object):
+
+    def __init__(self):
+        self._mongo_collection = FakeCollection()
+
+
+class DocstoreWriteBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.docstore = FakeDocstore()
+        self.batches = self.docstore._mongo_collection.batches
+        self.writes = DocstoreWriteBuffer(self.docstore, max_ops=10, max_delay_ms=60000)
+
+    def tearDown(self):
+        self.writes.flush()
+
+    def test_flush_without_writes(self):
+        self.writes.flush()
+        self.assertEqual(self.batches, [])
+
+    def test_upserts_of_a_doc_are_merged(self):
+        self.writes.upsert([{'id': 'a', 'title': 'one', 'butter_user_id': 1}])
+        self.writes.upsert([{'id': 'a', 'title': 'two', 'butter_user_id': 2}])
+        self.assertEqual(len(self.writes), 1)
+
+        self.writes.flush()
+        self.assertEqual(self.batches, [[
+            UpdateOne({'_id': 'a'},
+                      {'$setOnInsert': {'_id': 'a'},
+                       '$set': {'title': 'two'},
+                       '$addToSet': {'butter_user_id': {'$each': [1, 2]}}},
+                      upsert=True),
+        ]])
+
+    def test_upsert_then_delete_only_deletes(self):
+        self.writes.upsert([{'id': 'a', 'title': 'one'}])
+        self.writes.delete({'id': 'a'})
+        self.writes.flush()
+
+        self.assertEqual(self.batches, [[DeleteOne({'_id': 'a'})]])
+
+    def test_delete_then_upsert_deletes_first(self):
+        self.writes.delete({'id': 'a'})
+        self.writes.upsert([{'id': 'a', 'title': 'one'}])
+        self.writes.flush()
+
+        self.assertEqual(len(self.batches), 2)
+        self.assertEqual(self.batches[0], [DeleteOne({'_id': 'a'})])
+        self.assertEqual(len(self.batches[1]), 1)
+        self.assertIsInstance(self.batches[1][0], UpdateOne)
+
+    def test_unrelated_writes_share_a_batch(self):
+        self.writes.upsert([{'id': 'a', 'title': 'one'}])
+        self.writes.delete([{'id': 'b'}])
+        self.writes.flush()
+
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(len(self.batches[0]), 2)
+        self.assertIn(DeleteOne({'_id': 'b'}), self.batches[0])
+
+    def test_flushes_once_full(self):
+        self.writes.upsert([{'id': str(i), 'title': 'doc'} for i in range(10)])
+
+        self.assertEqual(len(self.writes), 0)
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(len(self.batches[0]), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()